@@ -26,9 +26,12 @@ This is a class-based version of https://github.com/laurensvalk/segway
 """
 import logging
 import math
+import os
 import time
 from collections import deque
 from ev3dev.auto import *
+from ev3dev.control import Loop
+from ev3dev.filters import ComplementaryFilter
 from ev3dev.helper import Tank
 
 
@@ -41,17 +44,14 @@ log = logging.getLogger(__name__)
 ##
 ########################################################################
 
-# Function for fast reading from sensor files
+# Function for fast reading from sensor files opened with os.open()
 def FastRead(infile):
-    infile.seek(0)
-    return int(infile.read().decode().strip())
+    return int(os.pread(infile, 16, 0))
 
 
-# Function for fast writing to motor files
+# Function for fast writing to motor files opened with os.open()
 def FastWrite(outfile, value):
-    outfile.truncate(0)
-    outfile.write(str(int(value)))
-    outfile.flush()
+    os.pwrite(outfile, Device._encode_int(value), 0)
 
 
 # Function to set the duty cycle of the motors
@@ -67,6 +67,12 @@ class GyroBalancer(Tank):
     """
     Base class for a robot that stands on two wheels and uses a gyro sensor
     to keep its balance.
+
+    By default the tilt angle is found by integrating the gyro rate. A
+    filter from ``ev3dev.filters`` can be given as ``estimator`` instead,
+    for example ``ComplementaryFilter(time_constant=2)`` to remove the drift
+    of the integration, and ``gyro_filter`` (e.g. a ``KalmanFilter``) is
+    applied to the gyro rate before use.
     """
 
     def __init__(self,
@@ -76,9 +82,23 @@ class GyroBalancer(Tank):
                  gainMotorAngularSpeed,           # For every radian/s drive faster than the reference value, apply this amount of duty cycle
                  gainMotorAngleErrorAccumulated,  # For every radian x s of accumulated motor angle,          apply this amount of duty cycle
                  left_motor=OUTPUT_D,
-                 right_motor=OUTPUT_A):
+                 right_motor=OUTPUT_A,
+                 loop_time_ms=10,                 # Period of the control loop
+                 remote_interval_ms=50,           # How often the remote control is read
+                 estimator=None,                  # Estimates the tilt angle from the gyro rate, see ev3dev.filters
+                 gyro_filter=None):               # Filters the gyro rate before it is used, see ev3dev.filters
         Tank.__init__(self, left_motor, right_motor)
 
+        self.loop_time_ms       = loop_time_ms
+        self.remote_interval_ms = remote_interval_ms
+
+        # The default estimator just integrates the gyro rate
+        self.estimator   = estimator if estimator is not None else ComplementaryFilter()
+        self.gyro_filter = gyro_filter
+
+        # Timing statistics of the last run of the control loop, see ev3dev.control.Loop
+        self.loop_stats = None
+
         # magic numbers
         self.gainGyroAngle                  = gainGyroAngle
         self.gainGyroRate                   = gainGyroRate
@@ -178,13 +198,24 @@ class GyroBalancer(Tank):
 
     def main(self):
 
+        files = []
+        bypassed = []
+
+        def fast_open(device, attribute, flags=os.O_RDONLY):
+            fd = os.open(device._path + "/" + attribute, flags)
+            files.append(fd)
+            if flags != os.O_RDONLY:
+                # Writes through fd are not in the record of written setpoints
+                bypassed.append((device, attribute))
+                device._written.pop(attribute, None)
+            return fd
+
         def shutdown():
-            touchSensorValueRaw.close()
-            gyroSensorValueRaw.close()
-            motorEncoderLeft.close()
-            motorEncoderRight.close()
-            motorDutyCycleLeft.close()
-            motorDutyCycleRight.close()
+            for fd in files:
+                os.close(fd)
+
+            for device, attribute in bypassed:
+                device._written.pop(attribute, None)
 
             for motor in list_motors():
                 motor.stop()
@@ -198,10 +229,13 @@ class GyroBalancer(Tank):
             ########################################################################
 
             # Timing settings for the program
-            loopTimeMilliSec        = 10                       # Time of each loop, measured in miliseconds.
+            loopTimeMilliSec        = self.loop_time_ms        # Time of each loop, measured in miliseconds.
             loopTimeSec             = loopTimeMilliSec/1000.0  # Time of each loop, measured in seconds.
             motorAngleHistoryLength = 3                        # Number of previous motor angles we keep track of.
 
+            # The remote control is read every remoteDecimation loops
+            remoteDecimation        = max(1, int(round(self.remote_interval_ms / loopTimeMilliSec)))
+
             # Math constants
             radiansPerDegree               = math.pi/180       # The number of radians in a degree.
 
@@ -220,6 +254,11 @@ class GyroBalancer(Tank):
             # A deque (a fifo array) which we'll use to keep track of previous motor positions, which we can use to calculate the rate of change (speed)
             motorAngleHistory = deque([0], motorAngleHistoryLength)
 
+            # The unit conversions applied on every loop, folded into single coefficients
+            motorAnglePerRawSum         = radiansPerRawMotorUnit/2                        # Average of both encoders, converted to radians
+            motorSpeedPerAngleChange    = 1/(motorAngleHistoryLength*loopTimeSec)         # Angle change over the history, converted to rad/s
+            motorAngleReferencePerSpeed = radPerSecPerPercentSpeed*loopTimeSec            # Reference angle change per loop for each "percent speed"
+
             # State feedback control gains (aka the magic numbers)
             gainGyroAngle                  = self.gainGyroAngle
             gainGyroRate                   = self.gainGyroRate
@@ -228,12 +267,9 @@ class GyroBalancer(Tank):
             gainMotorAngleErrorAccumulated = self.gainMotorAngleErrorAccumulated
 
             # Variables representing physical signals (more info on these in the docs)
-            # The angle of "the motor", measured in raw units (degrees for the
-            # EV3). We will take the average of both motor positions as "the motor"
+            # The angle of "the motor", in radians (2*pi radians equals 360 degrees).
+            # We will take the average of both motor positions as "the motor"
             # angle, wich is essentially how far the middle of the robot has traveled.
-            motorAngleRaw              = 0
-
-            # The angle of the motor, converted to radians (2*pi radians equals 360 degrees).
             motorAngle                 = 0
 
             # The reference angle of the motor. The robot will attempt to drive
@@ -276,18 +312,22 @@ class GyroBalancer(Tank):
             # it is moving even when it is perfectly still. We keep track of this offset.
             gyroOffset                 = 0
 
-            # filehandles for fast reads/writes
-            # =================================
-            touchSensorValueRaw = open(self.touch._path + "/value0", "rb")
-            gyroSensorValueRaw  = open(self.gyro._path + "/value0", "rb")
+            # raw file descriptors for fast reads/writes (os.pread/os.pwrite)
+            # ==============================================================
+            touchSensorValueRaw = fast_open(self.touch, "value0")
+            gyroSensorValueRaw  = fast_open(self.gyro, "value0")
 
             # Open motor files for (fast) reading
-            motorEncoderLeft    = open(self.left_motor._path + "/position", "rb")
-            motorEncoderRight   = open(self.right_motor._path + "/position", "rb")
+            motorEncoderLeft    = fast_open(self.left_motor, "position")
+            motorEncoderRight   = fast_open(self.right_motor, "position")
 
             # Open motor files for (fast) writing
-            motorDutyCycleLeft  = open(self.left_motor._path + "/duty_cycle_sp", "w")
-            motorDutyCycleRight = open(self.right_motor._path + "/duty_cycle_sp", "w")
+            motorDutyCycleLeft  = fast_open(self.left_motor, "duty_cycle_sp", os.O_WRONLY)
+            motorDutyCycleRight = fast_open(self.right_motor, "duty_cycle_sp", os.O_WRONLY)
+
+            # The remote control is read through the sensor object, so make
+            # sure its files are open before the first loop
+            self.remote.process()
 
             ########################################################################
             ##
@@ -316,20 +356,29 @@ class GyroBalancer(Tank):
             ##
             ########################################################################
 
+            # Tilt angle estimation
+            estimator   = self.estimator
+            gyroFilter  = self.gyro_filter
+            estimator.value = gyroEstimatedAngle
+
             # Initial touch sensor value
             touchSensorPressed = FastRead(touchSensorValueRaw)
 
-            while not touchSensorPressed:
+            # The loop keeps the timing and collects the timing statistics
+            loop = Loop(loopTimeMilliSec)
+            remoteTick = 0
 
-                ###############################################################
-                ##  Loop info
-                ###############################################################
-                tLoopStart = time.clock()
+            for tick in loop:
+
+                if touchSensorPressed:
+                    break
 
                 ###############################################################
-                ##  Reading the Remote Control
+                ##  Reading the Remote Control (not on every loop)
                 ###############################################################
-                self.remote.process()
+                if tick >= remoteTick:
+                    remoteTick = tick + remoteDecimation
+                    self.remote.process()
 
                 ###############################################################
                 ##  Reading the Gyro.
@@ -337,21 +386,24 @@ class GyroBalancer(Tank):
                 gyroRateRaw = FastRead(gyroSensorValueRaw)
                 gyroRate = (gyroRateRaw - gyroOffset)*radiansPerSecondPerRawGyroUnit
 
+                if gyroFilter is not None:
+                    gyroRate = gyroFilter.update(gyroRate)
+
                 ###############################################################
                 ##  Reading the Motor Position
                 ###############################################################
-                motorAngleRaw = (FastRead(motorEncoderLeft) + FastRead(motorEncoderRight))/2
-                motorAngle = motorAngleRaw*radiansPerRawMotorUnit
+                motorAngle = (FastRead(motorEncoderLeft) + FastRead(motorEncoderRight))*motorAnglePerRawSum
 
-                motorAngularSpeedReference = self.speed * radPerSecPerPercentSpeed
-                motorAngleReference = motorAngleReference + motorAngularSpeedReference * loopTimeSec
+                speed = self.speed
+                motorAngularSpeedReference = speed * radPerSecPerPercentSpeed
+                motorAngleReference = motorAngleReference + speed * motorAngleReferencePerSpeed
 
                 motorAngleError = motorAngle - motorAngleReference
 
                 ###############################################################
                 ##  Computing Motor Speed
                 ###############################################################
-                motorAngularSpeed = (motorAngle - motorAngleHistory[0])/(motorAngleHistoryLength * loopTimeSec)
+                motorAngularSpeed = (motorAngle - motorAngleHistory[0])*motorSpeedPerAngleChange
                 motorAngularSpeedError = motorAngularSpeed - motorAngularSpeedReference
                 motorAngleHistory.append(motorAngle)
 
@@ -373,7 +425,7 @@ class GyroBalancer(Tank):
                 ###############################################################
                 ##  Update angle estimate and Gyro Offset Estimate
                 ###############################################################
-                gyroEstimatedAngle = gyroEstimatedAngle + gyroRate * loopTimeSec
+                gyroEstimatedAngle = estimator.update(gyroRate, loopTimeSec)
                 gyroOffset = (1 - gyroDriftCompensationRate) * gyroOffset + gyroDriftCompensationRate * gyroRateRaw
 
                 ###############################################################
@@ -386,11 +438,10 @@ class GyroBalancer(Tank):
                 ###############################################################
                 touchSensorPressed = FastRead(touchSensorValueRaw)
 
-                ###############################################################
-                ##  Busy wait for the loop to complete
-                ###############################################################
-                while ((time.clock() - tLoopStart) <  loopTimeSec):
-                    time.sleep(0.0001)
+            stats = self.loop_stats = loop.stats()
+            log.info("%d loops, %d overruns, jitter p99 %.2f ms, loop time mean %.2f ms, max %.2f ms" % (
+                stats.ticks, stats.overruns, stats.jitter.percentile(99) * 1000,
+                stats.exec_time.mean * 1000, stats.exec_time.max * 1000))
 
             shutdown()
 
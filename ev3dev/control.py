@@ -0,0 +1,475 @@
+"""
+Helpers for running motors and control loops at a fixed rate.
+"""
+
+import os
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from .core import Device
+
+
+class Histogram(object):
+    """
+    Histogram of durations with fixed-width bins. Values past the last bin
+    are counted in an extra overflow bin.
+    """
+
+    def __init__(self, bin_width, bins):
+        """
+        Parameters:
+            bin_width: width of a bin in seconds.
+            bins: number of bins.
+        """
+        self.bin_width = bin_width
+
+        #: Number of values in each bin. The last item is the overflow bin.
+        self.counts = array('L', [0] * (bins + 1))
+
+        #: Number of values added.
+        self.count = 0
+
+        #: Largest value added.
+        self.max = 0
+
+        self._total = 0
+
+    def add(self, value):
+        """Adds a value (in seconds) to the histogram."""
+        i = int(value / self.bin_width)
+        if i < 0:
+            i = 0
+        elif i >= len(self.counts):
+            i = len(self.counts) - 1
+        self.counts[i] += 1
+        self.count += 1
+        self._total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        """Mean of the values added, in seconds."""
+        return self._total / self.count if self.count else 0
+
+    def percentile(self, p):
+        """
+        Returns the upper edge of the bin that contains the ``p``-th
+        percentile (0 to 100) of the values, in seconds. Returns `max` when
+        the percentile falls into the overflow bin.
+        """
+        limit = self.count * p / 100.0
+        seen = 0
+        for i, c in enumerate(self.counts[:-1]):
+            seen += c
+            if seen >= limit:
+                return (i + 1) * self.bin_width
+        return self.max
+
+
+#: Timing statistics returned by `Loop.stats()`.
+LoopStats = namedtuple('LoopStats', 'ticks overruns skipped jitter exec_time')
+
+
+class Loop(object):
+    """
+    Runs a control loop with a fixed period.
+
+    Each iteration is started at an absolute deadline on the monotonic
+    clock, so the loop does not drift no matter how long the iterations
+    take. The thread sleeps until the deadline, using a timerfd when the
+    platform provides one. An iteration that runs past the start of the
+    next one is an overrun: the next iteration starts right away, and the
+    ticks that passed in the meantime are skipped.
+
+    Iterating over the loop yields the tick number, which counts periods
+    since the start of the loop (and so jumps over skipped ticks).
+
+    The loop keeps histograms of the wakeup jitter (delay between the
+    deadline and the start of the iteration) and of the execution time of
+    the iterations, see `stats()`.
+
+    Example::
+
+        loop = Loop(10)
+        for tick in loop:
+            if touch.is_pressed:
+                break
+            ...
+
+        s = loop.stats()
+        print('overruns: %d, 99%% jitter: %.2f ms' % (
+            s.overruns, s.jitter.percentile(99) * 1000))
+    """
+
+    def __init__(self, period_ms, priority=None, cpus=None, bins=40):
+        """
+        Parameters:
+            period_ms: loop period in milliseconds.
+            priority: when given, the thread running the loop is switched to
+                the ``SCHED_FIFO`` real-time policy with this priority
+                (1-99). Requires root privileges.
+            cpus: when given, the process is pinned to this set of CPUs.
+            bins: number of bins in the timing histograms, each
+                ``period_ms / 20`` wide.
+        """
+        self.period = period_ms / 1000.0
+        self.priority = priority
+        self.cpus = cpus
+
+        self._bins = bins
+        self._stopped = False
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter = Histogram(self.period / 20, self._bins)
+        self.exec_time = Histogram(self.period / 20, self._bins)
+
+    def stop(self):
+        """Makes the loop exit before the next iteration."""
+        self._stopped = True
+
+    def stats(self):
+        """
+        Returns the timing statistics as a `LoopStats` tuple: number of
+        iterations, number of overruns, number of skipped ticks and the
+        `Histogram` objects of jitter and execution time.
+        """
+        return LoopStats(self.ticks, self.overruns, self.skipped,
+                         self.jitter, self.exec_time)
+
+    def run(self, body):
+        """
+        Calls ``body(tick)`` every period, until it returns ``False`` or
+        `stop()` is called.
+        """
+        for tick in self:
+            if body(tick) is False:
+                break
+
+    def __iter__(self):
+        if self.priority is not None:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+        if self.cpus is not None:
+            os.sched_setaffinity(0, self.cpus)
+
+        self._stopped = False
+        self._reset_stats()
+
+        timer = None
+        if hasattr(os, 'timerfd_create'):
+            timer = os.timerfd_create(time.CLOCK_MONOTONIC)
+
+        try:
+            period = self.period
+            tick = 0
+            deadline = time.monotonic()
+
+            while not self._stopped:
+                now = time.monotonic()
+                if now < deadline:
+                    if timer is not None:
+                        os.timerfd_settime(timer, flags=os.TFD_TIMER_ABSTIME, initial=deadline)
+                        os.read(timer, 8)
+                    else:
+                        time.sleep(deadline - now)
+                    now = time.monotonic()
+
+                self.jitter.add(now - deadline)
+                self.ticks += 1
+
+                yield tick
+
+                done = time.monotonic()
+                self.exec_time.add(done - now)
+
+                tick += 1
+                deadline += period
+
+                if done > deadline:
+                    self.overruns += 1
+                    behind = int((done - deadline) / period)
+                    self.skipped += behind
+                    tick += behind
+                    deadline += behind * period
+        finally:
+            if timer is not None:
+                os.close(timer)
+
+
+class DutyCycleStreamer(object):
+    """
+    Plays precomputed duty cycle trajectories on a set of motors. The motors
+    are put into ``run-direct`` mode, and a new `duty_cycle_sp` value is
+    written to each of them every ``1 / rate`` seconds.
+
+    Samples are paced by a `Loop`, so the timing does not drift and the
+    thread sleeps between samples instead of busy-waiting. When writing a
+    sample takes longer than the period, the samples that were due in the
+    meantime are skipped to keep the trajectory in time; such overruns are
+    counted in `missed`.
+
+    Example::
+
+        samples = array('b', [int(50 * math.sin(i / 50)) for i in range(1000)])
+        streamer = DutyCycleStreamer((left, right), (samples, samples), rate=100)
+        streamer.play()
+        print('Missed %d deadlines' % streamer.missed)
+    """
+
+    def __init__(self, motors, samples, rate):
+        """
+        Parameters:
+            motors: motors to drive.
+            samples: one sequence of duty cycle values (-100 to 100) per
+                motor, for example an ``array('b')`` or a NumPy array. All
+                sequences should have the same length.
+            rate: number of samples per second.
+        """
+        self.motors = motors
+        self.period = 1.0 / rate
+
+        #: Number of samples written after the next sample was already due.
+        self.missed = 0
+
+        #: Largest delay of a sample write past its due time, in seconds.
+        self.max_lateness = 0
+
+        #: The `Loop` used for the last playback, with its timing statistics.
+        self.loop = None
+
+        # Encode all samples up front.
+        self._frames = [
+                tuple(Device._encode_int(min(max(int(v), -100), 100)) for v in values)
+                for values in zip(*samples)]
+
+    def __len__(self):
+        return len(self._frames)
+
+    def play(self, stop=True):
+        """
+        Plays the trajectories, blocking until done. When ``stop`` is True,
+        the motors are stopped at the end.
+        """
+        motors = self.motors
+        frames = self._frames
+        attributes = [m._attribute_file_open('duty_cycle_sp') for m in motors]
+        loop = self.loop = Loop(self.period * 1000)
+
+        # Values that did not change since the last write are skipped.
+        written = [None] * len(motors)
+
+        # Load the first sample before starting the motors, so that they do
+        # not start with whatever duty_cycle_sp was holding.
+        if frames:
+            for i, data in enumerate(frames[0]):
+                motors[i]._write_attribute(attributes[i], 'duty_cycle_sp', data)
+                written[i] = data
+
+        for m in motors:
+            m.run_direct()
+
+        try:
+            for n in loop:
+                if n >= len(frames):
+                    break
+
+                for i, data in enumerate(frames[n]):
+                    if data != written[i]:
+                        motors[i]._write_attribute(attributes[i], 'duty_cycle_sp', data)
+                        written[i] = data
+        finally:
+            self.missed = loop.overruns
+            self.max_lateness = loop.jitter.max
+
+            if stop:
+                for m in motors:
+                    m.stop()
+
+
+class SensorSampler(object):
+    """
+    Samples a set of device attributes at a fixed rate in a background
+    thread, and keeps the last ``size`` samples in ring buffers.
+
+    Consumers read the buffered samples instead of the sysfs files, so a
+    value used in several places (a control loop, a logger, a web page) is
+    only read once per period. All attributes of a sample are read in the
+    same iteration and share a single timestamp (``time.monotonic()``).
+
+    Reads do not take a lock: they check that the writer did not overwrite
+    the samples while they were being copied, and retry otherwise.
+
+    The thread reads through its own file descriptors, so reading the same
+    attributes through the device objects at the same time is safe. When a
+    read fails, the previous value of the attribute is repeated, and the
+    failure is counted in `errors` (with the exception in `last_error`).
+
+    Example::
+
+        sampler = SensorSampler(rate=100)
+        gyro = sampler.add(gyro_sensor, 'value0')
+        position = sampler.add(motor, 'position')
+        sampler.start()
+
+        t, (rate, pos) = sampler.snapshot()
+        times, rates = sampler.window(gyro, 10)
+    """
+
+    def __init__(self, rate, size=100, priority=None):
+        """
+        Parameters:
+            rate: number of samples per second.
+            size: number of samples kept for each attribute.
+            priority: real-time priority of the sampling thread, see `Loop`.
+        """
+        self.period = 1.0 / rate
+        self.size = size
+        self.priority = priority
+
+        #: Number of samples taken since the start.
+        self.count = 0
+
+        #: The `Loop` of the sampling thread, with its timing statistics.
+        self.loop = None
+
+        #: Number of failed attribute reads.
+        self.errors = 0
+
+        #: The exception raised by the last failed read.
+        self.last_error = None
+
+        self._paths = []
+        self._files = []
+        self._values = []
+        self._times = array('d', [0.0] * size)
+        self._thread = None
+        self._running = False
+
+    def add(self, device, attribute):
+        """
+        Adds an integer attribute of a device to the sampled set, and returns
+        the key used to read its samples.
+        """
+        if self._thread is not None:
+            raise Exception('Cannot add attributes to a running sampler')
+
+        if not device.connected:
+            raise Exception('Device is not connected')
+
+        self._paths.append(device._path + '/' + attribute)
+        self._values.append(array('l', [0] * self.size))
+        return len(self._paths) - 1
+
+    def start(self):
+        """Starts the sampling thread."""
+        if self._thread is not None:
+            return
+
+        # os.pread() on private descriptors does not move a file offset
+        # shared with the device objects.
+        self._files = []
+        try:
+            for path in self._paths:
+                self._files.append(os.open(path, os.O_RDONLY))
+        except Exception:
+            self._close()
+            raise
+
+        self.loop = Loop(self.period * 1000, priority=self.priority)
+        self._running = True
+        self._thread = threading.Thread(target=self.loop.run, args=(self._sample,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the sampling thread."""
+        if self._thread is None:
+            return
+
+        self._running = False
+        self._thread.join()
+        self._thread = None
+        self._close()
+
+    def _close(self):
+        for fd in self._files:
+            os.close(fd)
+        self._files = []
+
+    def _sample(self, tick):
+        if not self._running:
+            return False
+
+        n = self.count
+        size = self.size
+        i = n % size
+
+        self._times[i] = time.monotonic()
+        for fd, values in zip(self._files, self._values):
+            try:
+                values[i] = int(os.pread(fd, 32, 0))
+            except Exception as e:
+                values[i] = values[(n - 1) % size]
+                self.errors += 1
+                self.last_error = e
+
+        # Publishing the new count makes the sample visible to readers.
+        self.count = n + 1
+
+    def latest(self, key):
+        """
+        Returns the most recent sample of an attribute, or ``None`` before
+        the first sample.
+        """
+        values = self._values[key]
+        while True:
+            n = self.count
+            if n == 0:
+                return None
+            value = values[(n - 1) % self.size]
+            if self.count - n < self.size - 1:
+                return value
+
+    def snapshot(self):
+        """
+        Returns the most recent sample of all attributes, as a
+        ``(timestamp, values)`` tuple where ``values`` is in the order the
+        attributes were added. Returns ``None`` before the first sample.
+        """
+        while True:
+            n = self.count
+            if n == 0:
+                return None
+            i = (n - 1) % self.size
+            t = self._times[i]
+            values = tuple(v[i] for v in self._values)
+            if self.count - n < self.size - 1:
+                return t, values
+
+    def window(self, key, n):
+        """
+        Returns the last ``n`` samples of an attribute (or fewer, when less
+        were taken) as a ``(timestamps, values)`` tuple of lists, oldest
+        first. ``n`` must be less than ``size``.
+        """
+        if n >= self.size:
+            raise ValueError('At most %d samples can be read at once' % (self.size - 1))
+
+        values = self._values[key]
+        times = self._times
+        size = self.size
+
+        while True:
+            count = self.count
+            first = max(count - n, 0)
+            slots = [j % size for j in range(first, count)]
+            t = [times[j] for j in slots]
+            v = [values[j] for j in slots]
+            if self.count - count < size - len(slots):
+                return t, v
@@ -40,6 +40,8 @@ if sys.version_info < (3,4):
 import os
 import io
 import fnmatch
+import logging
+import math
 import numbers
 import array
 import mmap
@@ -47,10 +49,13 @@ import ctypes
 import re
 import select
 import shlex
+import socket
 import stat
+import threading
 import time
+from collections import deque, namedtuple
 from os.path import abspath
-from struct import pack, unpack
+from struct import Struct, pack, unpack
 from subprocess import Popen, check_output, PIPE
 
 try:
@@ -61,15 +66,46 @@ try:
 except ImportError:
     print("WARNING: Failed to import fcntl. Button class will be unuseable!")
 
+log = logging.getLogger(__name__)
+
 INPUT_AUTO = ''
 OUTPUT_AUTO = ''
 
 # -----------------------------------------------------------------------------
+# Attributes that identify a device and never change while the device is
+# present. list_device_names() caches their values in the discovery index.
+_INDEXED_ATTRIBUTES = ('address', 'driver_name')
+
+# The discovery index: class path -> device name -> {attribute: value}.
+_discovery_index = {}
+
+def invalidate_device_index(class_name=None):
+    """
+    Forgets the cached identity attributes (`address` and `driver_name`) of
+    the devices seen by `list_device_names()`. The index is kept up to date
+    with devices being plugged in and unplugged, so this is only needed if
+    a device node was somehow replaced by another one with the same name.
+
+    Parameters:
+	class_name: only forget the devices of the given class, for example
+	    'tacho-motor'. When omitted, the whole index is cleared.
+    """
+    if class_name is None:
+        _discovery_index.clear()
+    else:
+        for class_path in list(_discovery_index):
+            if os.path.basename(class_path) == class_name:
+                del _discovery_index[class_path]
+
 def list_device_names(class_path, name_pattern, **kwargs):
     """
     This is a generator function that lists names of all devices matching the
     provided parameters.
 
+    Values of the `address` and `driver_name` attributes are read once per
+    device and kept in a process-wide index, so repeated lookups only cost a
+    single directory listing. Other attributes are read on every call.
+
     Parameters:
 	class_path: class path of the device, a subdirectory of /sys/class.
 	    For example, '/sys/class/tacho-motor'.
@@ -85,11 +121,15 @@ def list_device_names(class_path, name_pattern, **kwargs):
     if not os.path.isdir(class_path):
         return
 
-    def matches(attribute, pattern):
+    def read(attribute):
         try:
             with io.FileIO(attribute) as f:
-                value = f.read().strip().decode()
+                return f.read().strip().decode()
         except:
+            return None
+
+    def matches(value, pattern):
+        if value is None:
             return False
 
         if isinstance(pattern, list):
@@ -97,10 +137,27 @@ def list_device_names(class_path, name_pattern, **kwargs):
         else:
             return value.find(pattern) >= 0
 
-    for f in os.listdir(class_path):
+    names = os.listdir(class_path)
+    index = _discovery_index.setdefault(class_path, {})
+
+    # Drop the devices that are gone.
+    for name in set(index).difference(names):
+        index.pop(name, None)
+
+    for f in names:
         if fnmatch.fnmatch(f, name_pattern):
             path = class_path + '/' + f
-            if all([matches(path + '/' + k, kwargs[k]) for k in kwargs]):
+            cached = index.setdefault(f, {})
+
+            def value(k):
+                if k in cached:
+                    return cached[k]
+                v = read(path + '/' + k)
+                if v is not None and k in _INDEXED_ATTRIBUTES:
+                    cached[k] = v
+                return v
+
+            if all([matches(value(k), kwargs[k]) for k in kwargs]):
                 yield f
 
 # -----------------------------------------------------------------------------
@@ -109,13 +166,48 @@ def list_device_names(class_path, name_pattern, **kwargs):
 class Device(object):
     """The ev3dev device base class"""
 
-    __slots__ = ['_path', 'connected', '_device_index', 'kwargs']
+    __slots__ = ['_path', 'connected', '_device_index', 'kwargs', '_attributes', '_written']
 
     DEVICE_ROOT_PATH = '/sys/class'
 
+    #: Attribute files opened by `warm()` by default. Subclasses list the
+    #: attributes that are usually accessed in control loops.
+    HOT_ATTRIBUTES = ()
+
+    #: When set to True, attribute files are opened as raw file descriptors
+    #: and accessed with ``os.pread()``/``os.pwrite()``, which takes a single
+    #: system call per access instead of a seek followed by a read or write.
+    #: May be set on the `Device` class itself or on any of its subclasses,
+    #: and affects the attribute files opened after the change.
+    RAW_FD = False
+
     _DEVICE_INDEX = re.compile(r'^.*(?P<idx>\d+)$')
 
-    def __init__(self, class_name, name_pattern='*', name_exact=False, **kwargs):
+    # Size of the read buffer for raw attribute files. A sysfs attribute
+    # never exceeds the size of a page.
+    _RAW_READ_SIZE = 4096
+
+    _RAW_OPEN_FLAGS = {'r': os.O_RDONLY, 'w': os.O_WRONLY, 'r+': os.O_RDWR}
+
+    # Open modes of attribute files. Permissions are the same for all devices
+    # of a class, so the modes are keyed by class path and attribute name.
+    # Only writable modes are cached: udev sets the group permissions some
+    # time after a device appears (see ev3dev#225), and a mode read before
+    # that would otherwise stick for every device of the class.
+    _attribute_modes = {}
+
+    # Last values written to the attributes of each device: (device path,
+    # inode) -> {attribute name: encoded value}. The kernel keeps one value
+    # per device, so the record is shared by all the objects for the same
+    # device. The inode tells apart a device that was unplugged and got the
+    # same name when plugged in again.
+    _written_values = {}
+
+    # Preformatted representations of the most commonly written integer
+    # values (duty cycles, led brightness, etc).
+    _INT_BYTES = dict((i, str(i).encode()) for i in range(-255, 256))
+
+    def __init__(self, class_name, name_pattern='*', name_exact=False, preopen=False, **kwargs):
         """Spin through the Linux sysfs class for the device type and find
         a device that matches the provided name pattern and attributes (if any).
 
@@ -126,6 +218,9 @@ class Device(object):
                 For example, 'sensor*' or 'motor*'. Default value: '*'.
             name_exact: when True, assume that the name_pattern provided is the
                 exact device name and use it directly.
+            preopen: when True, open the attribute files listed in
+                `HOT_ATTRIBUTES` right away (see `warm()`). May also be a list
+                of attribute names to open.
             keyword arguments: used for matching the corresponding device
                 attributes. For example, address='outA', or
                 driver_name=['lego-ev3-us', 'lego-nxt-us']. When argument value
@@ -143,6 +238,9 @@ class Device(object):
         classpath = abspath(Device.DEVICE_ROOT_PATH + '/' + class_name)
         self.kwargs = kwargs
 
+        # Attribute files opened so far, keyed by the attribute name.
+        self._attributes = {}
+
         def get_index(file):
             match = Device._DEVICE_INDEX.match(file)
             if match:
@@ -165,6 +263,23 @@ class Device(object):
                 self._device_index = None
                 self.connected = False
 
+        # Last values written to the attributes, keyed by the attribute name.
+        try:
+            key = (self._path, os.stat(self._path).st_ino)
+            self._written = Device._written_values.setdefault(key, {})
+        except (TypeError, OSError):
+            self._written = {}
+
+        if preopen and self.connected:
+            self.warm(None if preopen is True else preopen)
+
+    def __del__(self):
+        # Unlike io.FileIO objects, raw file descriptors are not closed by the
+        # garbage collector.
+        for attribute in getattr(self, '_attributes', {}).values():
+            if type(attribute) is int:
+                os.close(attribute)
+
     def __str__(self):
         if 'address' in self.kwargs:
             return "%s(%s)" % (self.__class__.__name__, self.kwargs.get('address'))
@@ -172,50 +287,131 @@ class Device(object):
             return self.__class__.__name__
 
     def _attribute_file_open( self, name ):
+        attribute = self._attributes.get(name)
+        if attribute is not None:
+            return attribute
+
         path = self._path + '/' + name
-        mode = stat.S_IMODE(os.stat(path)[stat.ST_MODE])
-        r_ok = mode & stat.S_IRGRP
-        w_ok = mode & stat.S_IWGRP
-
-        if r_ok and w_ok:
-            mode = 'r+'
-        elif w_ok:
-            mode = 'w'
+        key = (os.path.dirname(self._path), name)
+        mode = Device._attribute_modes.get(key)
+
+        if mode is None:
+            mode = stat.S_IMODE(os.stat(path)[stat.ST_MODE])
+            r_ok = mode & stat.S_IRGRP
+            w_ok = mode & stat.S_IWGRP
+
+            if r_ok and w_ok:
+                mode = 'r+'
+            elif w_ok:
+                mode = 'w'
+            else:
+                mode = 'r'
+
+            if w_ok:
+                Device._attribute_modes[key] = mode
+
+        if self.RAW_FD:
+            attribute = os.open(path, Device._RAW_OPEN_FLAGS[mode])
         else:
-            mode = 'r'
+            attribute = io.FileIO(path, mode)
+        self._attributes[name] = attribute
+        return attribute
+
+    def _attribute_file_forget(self, name):
+        """Drop the cached file and open mode for the attribute, so that it
+        is reopened on next access."""
+        attribute = self._attributes.pop(name, None)
+        if type(attribute) is int:
+            try:
+                os.close(attribute)
+            except OSError:
+                pass
+        Device._attribute_modes.pop((os.path.dirname(self._path), name), None)
 
-        return io.FileIO(path, mode)
+    @staticmethod
+    def invalidate_attribute_modes(class_name=None):
+        """
+        Forgets the cached open modes of attribute files. The mode of a
+        writable attribute file is derived from its permissions on first
+        access and is shared by all devices of the same class. Call this if
+        the permissions have changed, e.g. after a driver has been reloaded.
+
+        Parameters:
+            class_name: only forget the modes for the given device class, for
+                example 'tacho-motor'. When omitted, the whole cache is
+                cleared.
+        """
+        if class_name is None:
+            Device._attribute_modes.clear()
+        else:
+            for key in list(Device._attribute_modes):
+                if os.path.basename(key[0]) == class_name:
+                    del Device._attribute_modes[key]
+
+    @staticmethod
+    def _read_raw(attribute, size=_RAW_READ_SIZE):
+        """Reads up to ``size`` bytes from the start of an attribute file
+        opened by `_attribute_file_open()`."""
+        if type(attribute) is int:
+            return os.pread(attribute, size, 0)
+        attribute.seek(0)
+        return attribute.read(size)
+
+    @staticmethod
+    def _write_raw(attribute, data):
+        """Writes ``data`` to an attribute file opened by
+        `_attribute_file_open()`."""
+        if type(attribute) is int:
+            os.pwrite(attribute, data, 0)
+        else:
+            attribute.seek(0)
+            attribute.write(data)
+            attribute.flush()
 
     def _get_attribute(self, attribute, name):
         """Device attribute getter"""
         if self.connected:
             if None == attribute:
                 attribute = self._attribute_file_open( name )
-            else:
-                attribute.seek(0)
-            return attribute, attribute.read().strip().decode()
+            return attribute, Device._read_raw(attribute).strip().decode()
         else:
             raise Exception('Device is not connected')
 
     def _set_attribute(self, attribute, name, value):
         """Device attribute setter"""
+        return self._write_attribute(attribute, name, value.encode())
+
+    def _write_attribute(self, attribute, name, data):
+        """Writes encoded value to the device attribute"""
         if self.connected:
             if None == attribute:
                 attribute = self._attribute_file_open( name )
-            else:
-                attribute.seek(0)
-            attribute.write(value.encode())
-            attribute.flush()
+            Device._write_raw(attribute, data)
+            self._written[name] = data
             return attribute
         else:
             raise Exception('Device is not connected')
 
     def get_attr_int(self, attribute, name):
-        attribute, value = self._get_attribute(attribute, name)
-        return attribute, int(value)
+        # int() accepts bytes with surrounding whitespace, so there is no need
+        # to decode and strip the value first.
+        if self.connected:
+            if None == attribute:
+                attribute = self._attribute_file_open( name )
+            return attribute, int(Device._read_raw(attribute))
+        else:
+            raise Exception('Device is not connected')
+
+    @staticmethod
+    def _encode_int(value):
+        value = int(value)
+        data = Device._INT_BYTES.get(value)
+        if data is None:
+            data = str(value).encode()
+        return data
 
     def set_attr_int(self, attribute, name, value):
-        return self._set_attribute(attribute, name, str(int(value)))
+        return self._write_attribute(attribute, name, Device._encode_int(value))
 
     def get_attr_string(self, attribute, name):
         return self._get_attribute(attribute, name)
@@ -238,6 +434,68 @@ class Device(object):
                 return v
         return ""
 
+    def _apply_setpoints(self, kwargs):
+        """Sets the attributes given as keyword arguments to a command.
+        Attributes that already hold the value last written to the device
+        are skipped, unless ``force=True`` is among the arguments."""
+        force = kwargs.pop('force', False)
+        written = self._written
+
+        for key in kwargs:
+            value = kwargs[key]
+            if not force and key in written:
+                if isinstance(value, str):
+                    data = value.encode()
+                else:
+                    data = Device._encode_int(value)
+                if written[key] == data:
+                    continue
+            setattr(self, key, value)
+
+    def warm(self, attrs=None):
+        """
+        Opens the attribute files up front, so that the first access to the
+        corresponding properties does not have to. Useful before entering a
+        control loop that should have deterministic timing from the first
+        iteration.
+
+        Parameters:
+            attrs: names of the attributes to open, for example
+                ``('position', 'duty_cycle_sp')``. Defaults to
+                `HOT_ATTRIBUTES` of the device class.
+        """
+        if not self.connected:
+            raise Exception('Device is not connected')
+
+        for name in self.HOT_ATTRIBUTES if attrs is None else attrs:
+            self._attribute_file_open(name)
+
+    def read_many(self, names):
+        """
+        Reads several attributes in one go and returns their values as a tuple
+        of strings, in the order given by ``names``. The attribute files are
+        opened on first use and cached, so that the same files are shared with
+        the corresponding properties.
+
+        This is cheaper than reading the properties one by one in a tight
+        control loop.
+
+        Example::
+
+            position, speed, state = m.read_many(('position', 'speed', 'state'))
+        """
+        if not self.connected:
+            raise Exception('Device is not connected')
+
+        attributes = self._attributes
+        values = []
+        for name in names:
+            attribute = attributes.get(name)
+            if attribute is None:
+                attribute = self._attribute_file_open(name)
+            values.append(Device._read_raw(attribute).strip().decode())
+        return tuple(values)
+
     @property
     def device_index(self):
         return self._device_index
@@ -264,6 +522,9 @@ def list_devices(class_name, name_pattern, **kwargs):
     return (Device(class_name, name, name_exact=True)
             for name in list_device_names(classpath, name_pattern, **kwargs))
 
+#: Motor state returned by `Motor.snapshot()`.
+MotorSnapshot = namedtuple('MotorSnapshot', 'position speed state duty_cycle')
+
 # ~autogen generic-class classes.motor>currentClass
 
 class Motor(Device):
@@ -320,6 +581,10 @@ class Motor(Device):
 # ~autogen
 
         self._poll = None
+        self._wait_wakeups = 0
+
+    HOT_ATTRIBUTES = ('command', 'duty_cycle', 'duty_cycle_sp', 'position',
+                      'speed', 'speed_sp', 'state')
 
     __slots__ = [
 # ~autogen generic-class-slots classes.motor>currentClass
@@ -354,6 +619,7 @@ class Motor(Device):
 
 # ~autogen
     '_poll',
+    '_wait_wakeups',
     ]
 
 # ~autogen generic-get-set classes.motor>currentClass
@@ -790,16 +1056,14 @@ class Motor(Device):
     def run_forever(self, **kwargs):
         """Run the motor until another command is sent.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RUN_FOREVER
 
     def run_to_abs_pos(self, **kwargs):
         """Run to an absolute position specified by `position_sp` and then
         stop using the action specified in `stop_action`.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RUN_TO_ABS_POS
 
     def run_to_rel_pos(self, **kwargs):
@@ -808,16 +1072,14 @@ class Motor(Device):
         When the new position is reached, the motor will stop using
         the action specified by `stop_action`.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RUN_TO_REL_POS
 
     def run_timed(self, **kwargs):
         """Run the motor for the amount of time specified in `time_sp`
         and then stop the motor using the action specified by `stop_action`.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RUN_TIMED
 
     def run_direct(self, **kwargs):
@@ -825,25 +1087,23 @@ class Motor(Device):
         Unlike other run commands, changing `duty_cycle_sp` while running *will*
         take effect immediately.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RUN_DIRECT
 
     def stop(self, **kwargs):
         """Stop any of the run commands before they are complete using the
         action specified by `stop_action`.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_STOP
 
     def reset(self, **kwargs):
         """Reset all of the motor parameter attributes to their default value.
         This will also have the effect of stopping the motor.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RESET
+        self._written.clear()
 
 
 # ~autogen
@@ -885,29 +1145,32 @@ class Motor(Device):
     def wait(self, cond, timeout=None):
         """
         Blocks until ``cond(self.state)`` is ``True``.  The condition is
-        checked when there is an I/O event related to the ``state`` attribute.
-        Exits early when ``timeout`` (in milliseconds) is reached.
+        checked right away, and then every time there is an I/O event related
+        to the ``state`` attribute. Exits early when ``timeout`` (in
+        milliseconds) is reached; the timeout is measured from the call, no
+        matter how many events arrive in the meantime.
 
         Returns ``True`` if the condition is met, and ``False`` if the timeout
         is reached.
         """
 
-        tic = time.time()
-
         if self._poll is None:
             if self._state is None:
                 self._state = self._attribute_file_open('state')
             self._poll = select.poll()
             self._poll.register(self._state, select.POLLPRI)
 
-        while True:
-            self._poll.poll(None if timeout is None else timeout)
-
-            if timeout is not None and time.time() >= tic + timeout / 1000:
-                return False
+        return _wait_motors((self,), cond, all, timeout, self._poll)
 
-            if cond(self.state):
-                return True
+    @property
+    def wait_wakeups(self):
+        """
+        Number of times the most recent wait on the motor (`wait()`,
+        `wait_until()`, `wait_while()`, `wait_all()` or `wait_any()`) woke up
+        to check the condition, not counting the initial check. Useful to
+        tell genuine state changes apart from spurious events.
+        """
+        return self._wait_wakeups
 
 
     def wait_until(self, s, timeout=None):
@@ -940,6 +1203,104 @@ class Motor(Device):
         """
         return self.wait(lambda state: s not in state, timeout)
 
+    def wait_async(self, cond, timeout=None, loop=None):
+        """
+        Asynchronous version of `wait()`. Returns an ``asyncio.Future`` that
+        resolves to ``True`` once ``cond(self.state)`` is ``True``, or to
+        ``False`` when ``timeout`` (in milliseconds) is reached.
+
+        The ``state`` attribute is watched by the event loop, so a single
+        thread may wait on any number of motors without polling.
+
+        Example::
+
+            yield from asyncio.gather(
+                    left.wait_while_async('running'),
+                    right.wait_while_async('running'))
+        """
+        # asyncio takes a while to import on the EV3, so only do it if needed.
+        import asyncio
+
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        future = asyncio.Future(loop=loop)
+
+        if cond(self.state):
+            future.set_result(True)
+            return future
+
+        # The state attribute signals changes with POLLPRI, and is always
+        # readable, so it is watched through an epoll object that is only
+        # ready when there is a change.
+        epoll = select.epoll()
+        epoll.register(self._state, select.EPOLLPRI)
+
+        def check():
+            if future.done():
+                return
+            # A failed read (e.g. the motor was unplugged, which also keeps
+            # the epoll ready) must end the wait, or the loop would spin here.
+            try:
+                if cond(self.state):
+                    future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        def expire():
+            if not future.done():
+                future.set_result(False)
+
+        timer = None if timeout is None else loop.call_later(timeout / 1000, expire)
+
+        def cleanup(future):
+            loop.remove_reader(epoll.fileno())
+            epoll.close()
+            if timer is not None:
+                timer.cancel()
+
+        loop.add_reader(epoll.fileno(), check)
+        future.add_done_callback(cleanup)
+        return future
+
+    def wait_until_async(self, s, timeout=None, loop=None):
+        """
+        Asynchronous version of `wait_until()`, see `wait_async()`.
+
+        Example::
+
+            yield from m.wait_until_async('holding')
+        """
+        return self.wait_async(lambda state: s in state, timeout, loop)
+
+    def wait_while_async(self, s, timeout=None, loop=None):
+        """
+        Asynchronous version of `wait_while()`, see `wait_async()`.
+
+        Example::
+
+            yield from m.wait_while_async('running')
+        """
+        return self.wait_async(lambda state: s not in state, timeout, loop)
+
+    _SNAPSHOT_ATTRIBUTES = ('position', 'speed', 'state', 'duty_cycle')
+
+    def snapshot(self):
+        """
+        Returns `position`, `speed`, `state` and `duty_cycle` of the motor as
+        a `MotorSnapshot` named tuple. All of the attributes are read in a
+        single pass, see `read_many()`.
+
+        Example::
+
+            s = m.snapshot()
+            print(s.position, s.speed)
+        """
+        position, speed, state, duty_cycle = self.read_many(self._SNAPSHOT_ATTRIBUTES)
+        return MotorSnapshot(int(position), int(speed),
+                             [v.strip('[]') for v in state.split()],
+                             int(duty_cycle))
+
 def list_motors(name_pattern=Motor.SYSTEM_DEVICE_NAME_CONVENTION, **kwargs):
     """
     This is a generator function that enumerates all tacho motors that match
@@ -959,6 +1320,188 @@ def list_motors(name_pattern=Motor.SYSTEM_DEVICE_NAME_CONVENTION, **kwargs):
     return (Motor(name_pattern=name, name_exact=True)
             for name in list_device_names(class_path, name_pattern, **kwargs))
 
+def _wait_motors(motors, cond, combine, timeout, poll=None):
+    """Blocks until ``combine`` of ``cond(m.state)`` over the motors is True,
+    watching all of the state attributes with one poll object. Only the time
+    left until the deadline is passed to each poll() call, so that spurious
+    events do not extend the wait. The number of wakeups is recorded in each
+    of the motors."""
+    if poll is None:
+        poll = select.poll()
+        for m in motors:
+            if m._state is None:
+                m._state = m._attribute_file_open('state')
+            poll.register(m._state, select.POLLPRI)
+
+    deadline = None if timeout is None else time.monotonic() + timeout / 1000
+    wakeups = 0
+
+    try:
+        while True:
+            # Every state has to be read on each pass, because a pending
+            # change event is only cleared by reading the attribute.
+            if combine([cond(m.state) for m in motors]):
+                return True
+
+            if deadline is None:
+                poll.poll(None)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                # Round up, so that we do not wake up just before the deadline.
+                poll.poll(math.ceil(remaining * 1000))
+
+            wakeups += 1
+    finally:
+        for m in motors:
+            m._wait_wakeups = wakeups
+
+def wait_all(motors, cond, timeout=None):
+    """
+    Blocks until ``cond(m.state)`` is ``True`` for every motor ``m`` in
+    ``motors``. State changes of all the motors are watched at once, so this
+    returns as soon as the last motor satisfies the condition. Exits early
+    when ``timeout`` (in milliseconds) is reached.
+
+    Returns ``True`` if the condition is met, and ``False`` if the timeout
+    is reached.
+
+    Example::
+
+        left.run_to_rel_pos(position_sp=360)
+        right.run_to_rel_pos(position_sp=360)
+        wait_all((left, right), lambda state: 'running' not in state)
+    """
+    return _wait_motors(motors, cond, all, timeout)
+
+def wait_any(motors, cond, timeout=None):
+    """
+    Blocks until ``cond(m.state)`` is ``True`` for at least one motor ``m``
+    in ``motors``. Exits early when ``timeout`` (in milliseconds) is reached.
+
+    Returns ``True`` if the condition is met, and ``False`` if the timeout
+    is reached.
+
+    Example::
+
+        # Stop both motors as soon as one of them stalls:
+        if wait_any((left, right), lambda state: 'stalled' in state, 5000):
+            left.stop()
+            right.stop()
+    """
+    return _wait_motors(motors, cond, any, timeout)
+
+class MotorGroup(object):
+    """
+    A group of tacho motors that are commanded together. Setpoints given to
+    a command are written to every motor first, and then the command itself
+    is written to all of the motors back to back, using the command files
+    opened when the group was created. This keeps the delay between the
+    motors starting (the skew) as short as possible.
+
+    Keyword arguments of the commands work as for a single `Motor`. When a
+    value is a list or a tuple, its items are used for the corresponding
+    motors in turn.
+
+    Example::
+
+        drive = MotorGroup(LargeMotor(OUTPUT_B), LargeMotor(OUTPUT_C))
+        drive.run_timed(time_sp=1000, speed_sp=(400, -400))
+        drive.wait_while('running')
+        print('Skew: %.0f us' % (drive.last_skew * 1e6))
+    """
+
+    def __init__(self, *motors):
+        self.motors = motors
+
+        #: Time in seconds it took to write the last command to all of the
+        #: motors.
+        self.last_skew = None
+
+        #: The longest skew seen so far, in seconds.
+        self.max_skew = 0
+
+        #: Number of commands issued to the group.
+        self.command_count = 0
+
+        for m in motors:
+            m.warm(('command', 'state'))
+        self._commands = [m._attribute_file_open('command') for m in motors]
+
+    def __str__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(str(m) for m in self.motors))
+
+    def _command(self, command, kwargs):
+        force = kwargs.pop('force', False)
+
+        for i, m in enumerate(self.motors):
+            setpoints = dict((k, v[i] if isinstance(v, (list, tuple)) else v)
+                             for k, v in kwargs.items())
+            setpoints['force'] = force
+            m._apply_setpoints(setpoints)
+
+        data = command.encode()
+        start = time.monotonic()
+        for m, attribute in zip(self.motors, self._commands):
+            m._write_attribute(attribute, 'command', data)
+        skew = time.monotonic() - start
+
+        self.last_skew = skew
+        self.max_skew = max(self.max_skew, skew)
+        self.command_count += 1
+
+    def run_forever(self, **kwargs):
+        """Run all motors until another command is sent."""
+        self._command(Motor.COMMAND_RUN_FOREVER, kwargs)
+
+    def run_to_abs_pos(self, **kwargs):
+        """Run all motors to the absolute position specified by
+        `position_sp`."""
+        self._command(Motor.COMMAND_RUN_TO_ABS_POS, kwargs)
+
+    def run_to_rel_pos(self, **kwargs):
+        """Run all motors to the position relative to their current
+        `position`."""
+        self._command(Motor.COMMAND_RUN_TO_REL_POS, kwargs)
+
+    def run_timed(self, **kwargs):
+        """Run all motors for the amount of time specified in `time_sp`."""
+        self._command(Motor.COMMAND_RUN_TIMED, kwargs)
+
+    def run_direct(self, **kwargs):
+        """Run all motors at the duty cycle specified by `duty_cycle_sp`."""
+        self._command(Motor.COMMAND_RUN_DIRECT, kwargs)
+
+    def stop(self, **kwargs):
+        """Stop all motors using the action specified by `stop_action`."""
+        self._command(Motor.COMMAND_STOP, kwargs)
+
+    def reset(self, **kwargs):
+        """Reset all motor parameter attributes to their default values."""
+        self._command(Motor.COMMAND_RESET, kwargs)
+        for m in self.motors:
+            m._written.clear()
+
+    def wait_all(self, cond, timeout=None):
+        """
+        Blocks until ``cond(m.state)`` is ``True`` for every motor in the
+        group, see `wait_all()`.
+        """
+        return wait_all(self.motors, cond, timeout)
+
+    def wait_until(self, s, timeout=None):
+        """
+        Blocks until ``s`` is in the state of every motor in the group.
+        """
+        return wait_all(self.motors, lambda state: s in state, timeout)
+
+    def wait_while(self, s, timeout=None):
+        """
+        Blocks until ``s`` is not in the state of any motor in the group.
+        """
+        return wait_all(self.motors, lambda state: s not in state, timeout)
+
 # ~autogen generic-class classes.largeMotor>currentClass
 
 class LargeMotor(Motor):
@@ -1086,6 +1629,8 @@ class DcMotor(Device):
 
 # ~autogen
 
+    HOT_ATTRIBUTES = ('command', 'duty_cycle_sp', 'state')
+
     __slots__ = [
 # ~autogen generic-class-slots classes.dcMotor>currentClass
 
@@ -1298,16 +1843,14 @@ class DcMotor(Device):
     def run_forever(self, **kwargs):
         """Run the motor until another command is sent.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RUN_FOREVER
 
     def run_timed(self, **kwargs):
         """Run the motor for the amount of time specified in `time_sp`
         and then stop the motor using the action specified by `stop_action`.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RUN_TIMED
 
     def run_direct(self, **kwargs):
@@ -1315,16 +1858,14 @@ class DcMotor(Device):
         Unlike other run commands, changing `duty_cycle_sp` while running *will*
         take effect immediately.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RUN_DIRECT
 
     def stop(self, **kwargs):
         """Stop any of the run commands before they are complete using the
         action specified by `stop_action`.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_STOP
 
 
@@ -1538,19 +2079,24 @@ class ServoMotor(Device):
     def run(self, **kwargs):
         """Drive servo to the position set in the `position_sp` attribute.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_RUN
 
     def float(self, **kwargs):
         """Remove power from the motor.
         """
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self._apply_setpoints(kwargs)
         self.command = self.COMMAND_FLOAT
 
 
 # ~autogen
+
+#: Description of a sensor mode, see `Sensor.mode_info`. ``scale`` is the
+#: number the values are divided by to apply ``decimals``, and
+#: ``bin_data_struct`` is the `struct.Struct` that decodes ``bin_data``.
+SensorModeInfo = namedtuple('SensorModeInfo',
+        'mode decimals num_values units bin_data_format scale bin_data_struct')
+
 # ~autogen generic-class classes.sensor>currentClass
 
 class Sensor(Device):
@@ -1596,9 +2142,23 @@ class Sensor(Device):
         self._value = [None,None,None,None,None,None,None,None]
 
         self._bin_data_format = None
-        self._bin_data_size = None
         self._bin_data = None
 
+        self._mode_table = {}
+
+    HOT_ATTRIBUTES = ('value0',)
+
+    # Byte order and struct/array type code of each bin_data_format.
+    _BIN_DATA_FORMATS = {
+            'u8':     '<B',
+            's8':     '<b',
+            'u16':    '<H',
+            's16':    '<h',
+            's16_be': '>h',
+            's32':    '<i',
+            'float':  '<f',
+        }
+
     __slots__ = [
 # ~autogen generic-class-slots classes.sensor>currentClass
 
@@ -1615,8 +2175,8 @@ class Sensor(Device):
 # ~autogen
     '_value',
     '_bin_data_format',
-    '_bin_data_size',
     '_bin_data',
+    '_mode_table',
     ]
 
 # ~autogen generic-get-set classes.sensor>currentClass
@@ -1651,23 +2211,25 @@ class Sensor(Device):
         return value
 
     @property
-    def decimals(self):
+    def driver_name(self):
         """
-        Returns the number of decimal places for the values in the `value<N>`
-        attributes of the current mode.
+        Returns the name of the sensor device/driver. See the list of [supported
+        sensors] for a complete list of drivers.
         """
-        self._decimals, value = self.get_attr_int(self._decimals, 'decimals')
+        self._driver_name, value = self.get_attr_string(self._driver_name, 'driver_name')
         return value
 
     @property
-    def driver_name(self):
+    def modes(self):
         """
-        Returns the name of the sensor device/driver. See the list of [supported
-        sensors] for a complete list of drivers.
+        Returns a list of the valid modes for the sensor.
         """
-        self._driver_name, value = self.get_attr_string(self._driver_name, 'driver_name')
+        self._modes, value = self.get_attr_set(self._modes, 'modes')
         return value
 
+
+# ~autogen
+
     @property
     def mode(self):
         """
@@ -1675,19 +2237,62 @@ class Sensor(Device):
         sets the sensor to that mode.
         """
         self._mode, value = self.get_attr_string(self._mode, 'mode')
+
+        # Someone else may have changed the mode.
+        self._written['mode'] = value.encode()
+
         return value
 
     @mode.setter
     def mode(self, value):
         self._mode = self.set_attr_string(self._mode, 'mode', value)
 
+    def _switch_mode(self, mode):
+        """
+        Sets the mode, unless the sensor is known to be in that mode already.
+        Used by the properties that need a given mode, so that reading them
+        in a loop does not write the mode every time. The last mode written
+        or read is shared by all the objects for the same sensor.
+        """
+        if self._written.get('mode') != mode.encode():
+            self.mode = mode
+
     @property
-    def modes(self):
+    def mode_info(self):
+        """
+        Returns the description of the current mode as a `SensorModeInfo`
+        tuple. The attributes describing a mode are read once per mode and
+        then remembered, so this does not read anything from the sensor
+        unless the mode was changed to one that was not used before.
+
+        The description follows the mode written (or read with `mode`)
+        through any of the objects for the same sensor in this program.
+        """
+        key = self._written.get('mode')
+        info = self._mode_table.get(key)
+        if info is None:
+            mode = self.mode
+            key = self._written['mode']
+            info = self._mode_table.get(key)
+            if info is None:
+                self._decimals, decimals = self.get_attr_int(self._decimals, 'decimals')
+                self._num_values, num_values = self.get_attr_int(self._num_values, 'num_values')
+                self._units, units = self.get_attr_string(self._units, 'units')
+                self._bin_data_format, fmt = self.get_attr_string(self._bin_data_format, 'bin_data_format')
+
+                code = self._BIN_DATA_FORMATS.get(fmt, '<B')
+                info = SensorModeInfo(mode, decimals, num_values, units, fmt,
+                        10 ** decimals, Struct(code[0] + str(num_values) + code[1]))
+                self._mode_table[key] = info
+        return info
+
+    @property
+    def decimals(self):
         """
-        Returns a list of the valid modes for the sensor.
+        Returns the number of decimal places for the values in the `value<N>`
+        attributes of the current mode.
         """
-        self._modes, value = self.get_attr_set(self._modes, 'modes')
-        return value
+        return self.mode_info.decimals
 
     @property
     def num_values(self):
@@ -1695,8 +2300,7 @@ class Sensor(Device):
         Returns the number of `value<N>` attributes that will return a valid value
         for the current mode.
         """
-        self._num_values, value = self.get_attr_int(self._num_values, 'num_values')
-        return value
+        return self.mode_info.num_values
 
     @property
     def units(self):
@@ -1704,11 +2308,7 @@ class Sensor(Device):
         Returns the units of the measured value for the current mode. May return
         empty string
         """
-        self._units, value = self.get_attr_string(self._units, 'units')
-        return value
-
-
-# ~autogen
+        return self.mode_info.units
 
     def value(self, n=0):
         """
@@ -1729,6 +2329,58 @@ class Sensor(Device):
         self._value[n], value = self.get_attr_int(self._value[n], 'value'+str(n))
         return value
 
+    def value_scaled(self, n=0):
+        """
+        Returns the value ``n`` converted to a floating point number according
+        to `decimals`. Only the value itself is read from the sensor.
+        """
+        return self.value(n) / self.mode_info.scale
+
+    def wait_async(self, cond, n=0, timeout=None, interval=10, loop=None):
+        """
+        Returns an ``asyncio.Future`` that resolves to ``True`` once
+        ``cond(self.value(n))`` is ``True``, or to ``False`` when ``timeout``
+        (in milliseconds) is reached.
+
+        Sensor drivers do not notify about value changes, so the value is
+        sampled by the event loop every ``interval`` milliseconds, without
+        blocking the thread.
+
+        Example::
+
+            # Wait for the touch sensor to be pressed:
+            yield from touch.wait_async(lambda value: value == 1)
+
+            # Wait for any change of the value:
+            yield from ir.wait_async(lambda value, old=ir.value(): value != old)
+        """
+        # asyncio takes a while to import on the EV3, so only do it if needed.
+        import asyncio
+
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        future = asyncio.Future(loop=loop)
+        deadline = None if timeout is None else loop.time() + timeout / 1000
+
+        def check():
+            if future.done():
+                return
+            try:
+                if cond(self.value(n)):
+                    future.set_result(True)
+                    return
+            except Exception as e:
+                future.set_exception(e)
+                return
+            if deadline is not None and loop.time() >= deadline:
+                future.set_result(False)
+            else:
+                loop.call_later(interval / 1000, check)
+
+        check()
+        return future
+
     @property
     def bin_data_format(self):
         """
@@ -1743,8 +2395,16 @@ class Sensor(Device):
         - `s32`: Signed 32-bit integer (int)
         - `float`: IEEE 754 32-bit floating point (float)
         """
-        self._bin_data_format, value = self.get_attr_string(self._bin_data_format, 'bin_data_format')
-        return value
+        return self.mode_info.bin_data_format
+
+    def _bin_data_layout(self):
+        return self.mode_info.bin_data_struct
+
+    def _bin_data_read(self, size):
+        if None == self._bin_data:
+            self._bin_data = self._attribute_file_open( 'bin_data' )
+
+        return Device._read_raw(self._bin_data, size)
 
     def bin_data(self, fmt=None):
         """
@@ -1752,7 +2412,8 @@ class Sensor(Device):
         array. Use `bin_data_format`, `num_values` and the individual sensor
         documentation to determine how to interpret the data.
 
-        Use `fmt` to unpack the raw bytes into a struct.
+        Use `fmt` to unpack the raw bytes into a struct. Use `bin_data_values`
+        to have them unpacked according to `bin_data_format`.
 
         Example::
 
@@ -1763,27 +2424,58 @@ class Sensor(Device):
             >>> ir.bin_data('<b')
             (28,)
         """
+        raw = bytearray(self._bin_data_read(self._bin_data_layout().size))
 
-        if self._bin_data_size == None:
-            self._bin_data_size = {
-                    "u8":     1,
-                    "s8":     1,
-                    "u16":    2,
-                    "s16":    2,
-                    "s16_be": 2,
-                    "s32":    4,
-                    "float":  4
-                }.get(self.bin_data_format, 1) * self.num_values
+        if fmt is None: return raw
 
-        if None == self._bin_data:
-            self._bin_data = self._attribute_file_open( 'bin_data' )
+        return unpack(fmt, raw)
 
-        self._bin_data.seek(0)
-        raw = bytearray(self._bin_data.read(self._bin_data_size))
+    def bin_data_into(self, buffer):
+        """
+        Reads the raw values into ``buffer`` (a ``bytearray``, ``memoryview``
+        or any other writable buffer at least as large as the data) and
+        returns the number of bytes read. This allows to reuse one buffer
+        for every read.
+        """
+        data = self._bin_data_read(self._bin_data_layout().size)
+        memoryview(buffer)[:len(data)] = data
+        return len(data)
 
-        if fmt is None: return raw
+    def bin_data_values(self):
+        """
+        Returns all the unscaled values of the current mode as a tuple, read
+        with a single system call and decoded according to `bin_data_format`.
 
-        return unpack(fmt, raw)
+        Example::
+
+            >>> color = ColorSensor()
+            >>> color.mode = 'RGB-RAW'
+            >>> color.bin_data_values()
+            (121, 250, 98)
+        """
+        layout = self._bin_data_layout()
+        return layout.unpack(self._bin_data_read(layout.size))
+
+    def bin_data_array(self, numpy=False):
+        """
+        Returns all the unscaled values of the current mode as an
+        ``array.array``, or as a NumPy array when ``numpy`` is ``True``.
+        """
+        layout = self._bin_data_layout()
+        data = self._bin_data_read(layout.size)
+        code = layout.format
+        if isinstance(code, bytes):
+            code = code.decode()
+
+        if numpy:
+            # NumPy is not needed for anything else, so only import it here.
+            import numpy as np
+            return np.frombuffer(data, dtype=np.dtype(code[0] + code[-1]))
+
+        values = array.array(code[-1], data)
+        if (code[0] == '>') != (sys.byteorder == 'big'):
+            values.byteswap()
+        return values
 
 def list_sensors(name_pattern=Sensor.SYSTEM_DEVICE_NAME_CONVENTION, **kwargs):
     """
@@ -1885,7 +2577,7 @@ class TouchSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_TOUCH
+            self._switch_mode(self.MODE_TOUCH)
 
         return self.value(0)
 
@@ -1972,7 +2664,7 @@ class ColorSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_COL_REFLECT
+            self._switch_mode(self.MODE_COL_REFLECT)
 
         return self.value(0)
 
@@ -1983,7 +2675,7 @@ class ColorSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_COL_AMBIENT
+            self._switch_mode(self.MODE_COL_AMBIENT)
 
         return self.value(0)
 
@@ -2002,7 +2694,7 @@ class ColorSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_COL_COLOR
+            self._switch_mode(self.MODE_COL_COLOR)
 
         return self.value(0)
 
@@ -2013,7 +2705,7 @@ class ColorSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_RGB_RAW
+            self._switch_mode(self.MODE_RGB_RAW)
 
         return self.value(0), self.value(1), self.value(2)
 
@@ -2024,7 +2716,7 @@ class ColorSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_RGB_RAW
+            self._switch_mode(self.MODE_RGB_RAW)
 
         return self.value(0)
 
@@ -2035,7 +2727,7 @@ class ColorSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_RGB_RAW
+            self._switch_mode(self.MODE_RGB_RAW)
 
         return self.value(1)
 
@@ -2046,7 +2738,7 @@ class ColorSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_RGB_RAW
+            self._switch_mode(self.MODE_RGB_RAW)
 
         return self.value(2)
 
@@ -2099,7 +2791,7 @@ class UltrasonicSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_US_DIST_CM
+            self._switch_mode(self.MODE_US_DIST_CM)
 
         return self.value(0)
 
@@ -2111,7 +2803,7 @@ class UltrasonicSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_US_DIST_IN
+            self._switch_mode(self.MODE_US_DIST_IN)
 
         return self.value(0)
 
@@ -2123,7 +2815,7 @@ class UltrasonicSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_US_LISTEN
+            self._switch_mode(self.MODE_US_LISTEN)
 
         return self.value(0)
 
@@ -2176,7 +2868,7 @@ class GyroSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_GYRO_ANG
+            self._switch_mode(self.MODE_GYRO_ANG)
 
         return self.value(0)
 
@@ -2187,7 +2879,7 @@ class GyroSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_GYRO_RATE
+            self._switch_mode(self.MODE_GYRO_RATE)
 
         return self.value(0)
 
@@ -2198,7 +2890,7 @@ class GyroSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_GYRO_G_A
+            self._switch_mode(self.MODE_GYRO_G_A)
 
         return self.value(0), self.value(1)
 
@@ -2251,7 +2943,7 @@ class InfraredSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_IR_PROX
+            self._switch_mode(self.MODE_IR_PROX)
 
         return self.value(0)
 
@@ -2292,7 +2984,7 @@ class SoundSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_DB
+            self._switch_mode(self.MODE_DB)
 
         return self.value(0)
 
@@ -2304,7 +2996,7 @@ class SoundSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_DBA
+            self._switch_mode(self.MODE_DBA)
 
         return self.value(0)
 
@@ -2344,7 +3036,7 @@ class LightSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_REFLECT
+            self._switch_mode(self.MODE_REFLECT)
 
         return self.value(0)
 
@@ -2355,7 +3047,7 @@ class LightSensor(Sensor):
         """
 
         if self.auto_mode:
-            self.mode = self.MODE_AMBIENT
+            self._switch_mode(self.MODE_AMBIENT)
 
         return self.value(0)
 
@@ -2390,6 +3082,8 @@ class Led(Device):
 
 # ~autogen
 
+    HOT_ATTRIBUTES = ('brightness',)
+
     __slots__ = [
 # ~autogen generic-class-slots classes.led>currentClass
 
@@ -2507,6 +3201,7 @@ class Led(Device):
             except OSError:
                 if retry:
                     self._delay_on = None
+                    self._attribute_file_forget('delay_on')
                 else:
                     raise
 
@@ -2524,6 +3219,7 @@ class Led(Device):
             except OSError:
                 if retry:
                     self._delay_on = None
+                    self._attribute_file_forget('delay_on')
                 else:
                     raise
 
@@ -2547,6 +3243,7 @@ class Led(Device):
             except OSError:
                 if retry:
                     self._delay_off = None
+                    self._attribute_file_forget('delay_off')
                 else:
                     raise
 
@@ -2564,6 +3261,7 @@ class Led(Device):
             except OSError:
                 if retry:
                     self._delay_off = None
+                    self._attribute_file_forget('delay_off')
                 else:
                     raise
 
@@ -2580,11 +3278,48 @@ class Led(Device):
         self.brightness = value * self.max_brightness
 
 
+#: Button press or release recorded by `ButtonBase`. ``timestamp`` is in
+#: seconds since the epoch (the clock of the kernel input events).
+ButtonEvent = namedtuple('ButtonEvent', 'timestamp button pressed')
+
+
 class ButtonBase(object):
     """
     Abstract button interface.
+
+    Every press and release noticed by `process()` (or by the event-driven
+    methods of `ButtonEVIO`) is recorded as a `ButtonEvent` in a bounded
+    queue. The queue is read with `events_since()`, `wait_for_press()`, or
+    by iterating over the object with ``async for``. Changes that follow the
+    previous change of the same button within `debounce` milliseconds are
+    ignored.
+
+    Example::
+
+        if btn.wait_for_press('enter', timeout=5000):
+            print('enter pressed')
+
+        async for event in btn:
+            print(event.button, event.pressed)
     """
 
+    #: Changes of a button within this many milliseconds after its previous
+    #: change are ignored.
+    debounce = 0
+
+    #: Number of events kept in the queue.
+    event_queue_size = 64
+
+    #: How often the buttons are polled (in milliseconds) while waiting for
+    #: events, when no event source is available.
+    poll_interval = 10
+
+    _events = None
+    _event_count = 0
+    _change_times = None
+    _waiters = None
+    _polling = False
+
     def __str__(self):
         return self.__class__.__name__
 
@@ -2597,42 +3332,223 @@ class ButtonBase(object):
         """
         pass
 
-    _state = set([])
+    _state = frozenset()
+
+    def _pressed(self):
+        """
+        Returns the set of pressed buttons. Subclasses may return the same
+        (immutable) set as long as the state does not change.
+        """
+        return frozenset(self.buttons_pressed)
 
     def any(self):
         """
         Checks if any button is pressed.
         """
-        return bool(self.buttons_pressed)
+        return bool(self._pressed())
 
     def check_buttons(self, buttons=[]):
         """
         Check if currently pressed buttons exactly match the given list.
         """
-        return set(self.buttons_pressed) == set(buttons)
+        return self._pressed() == set(buttons)
 
     def process(self):
         """
         Check for currenly pressed buttons. If the new state differs from the
         old state, call the appropriate button event handlers.
         """
-        new_state = set(self.buttons_pressed)
+        new_state = self._pressed()
         old_state = self._state
-        self._state = new_state
+        if new_state == old_state:
+            return
+
+        now = time.time()
+        changed = [(button, button in new_state)
+                for button in sorted(new_state.symmetric_difference(old_state))
+                if self._record(now, button, button in new_state)]
+        if not changed:
+            return
 
-        state_diff = new_state.symmetric_difference(old_state)
-        for button in state_diff:
+        self._state = frozenset(old_state).symmetric_difference(button for button, state in changed)
+        self._dispatch(changed)
+
+    def _dispatch(self, changed):
+        for button, state in changed:
             handler = getattr(self, 'on_' + button)
-            if handler is not None: handler(button in new_state)
+            if handler is not None: handler(state)
+
+        if self.on_change is not None:
+            self.on_change(changed)
+
+    def _record(self, timestamp, button, pressed, debounce=True):
+        """
+        Adds an event to the queue, and wakes up the ``async for`` readers.
+        Returns ``False`` if the event was dropped by the debounce filter.
+        """
+        if self._events is None:
+            self._events = deque(maxlen=self.event_queue_size)
+            self._change_times = {}
+
+        last = self._change_times.get(button)
+        if debounce and last is not None and (timestamp - last) * 1000 < self.debounce:
+            return False
+        self._change_times[button] = timestamp
+
+        self._events.append(ButtonEvent(timestamp, button, pressed))
+        self._event_count += 1
+
+        if self._waiters:
+            self._wake()
 
-        if self.on_change is not None and state_diff:
-            self.on_change([(button, button in new_state) for button in state_diff])
+        return True
+
+    def _wake(self):
+        """
+        Resolves the pending ``__anext__()`` futures for which an event is
+        available, in the order they were requested.
+        """
+        pending = []
+        for iterator, future in self._waiters:
+            if future.done():
+                continue
+            event = iterator._next_event()
+            if event is None:
+                pending.append((iterator, future))
+            else:
+                future.set_result(event)
+        self._waiters = pending
+
+    def _events_after(self, count):
+        """
+        Returns the queued events recorded after the first ``count`` ones.
+        """
+        if self._events is None:
+            return []
+        first = self._event_count - len(self._events)
+        return list(self._events)[max(count - first, 0):]
+
+    def events_since(self, t):
+        """
+        Returns the queued events with a timestamp (as returned by
+        ``time.time()``) later than ``t``, oldest first.
+        """
+        if self._events is None:
+            return []
+        return [event for event in self._events if event.timestamp > t]
+
+    def _wait_events(self, timeout):
+        """
+        Waits up to ``timeout`` milliseconds for new events. Polls with
+        `process()` by default.
+        """
+        interval = self.poll_interval if timeout is None else min(self.poll_interval, timeout)
+        time.sleep(interval / 1000)
+        self.process()
+
+    def wait_for_press(self, button, timeout=None):
+        """
+        Waits until the given button is pressed. Returns ``True`` if it was,
+        or ``False`` when ``timeout`` (in milliseconds) is reached. Presses
+        recorded before the call do not count. Button handlers are called
+        while waiting.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000
+        count = self._event_count
+
+        while True:
+            for event in self._events_after(count):
+                if event.button == button and event.pressed:
+                    return True
+            count = self._event_count
+
+            remaining = None
+            if deadline is not None:
+                remaining = (deadline - time.monotonic()) * 1000
+                if remaining <= 0:
+                    return False
+
+            self._wait_events(remaining)
+
+    def _watch(self, loop):
+        """
+        Makes sure that ``loop`` produces events for the ``async for``
+        readers. Polls with `process()` by default.
+        """
+        if self._polling:
+            return
+        self._polling = True
+
+        def poll():
+            self.process()
+            self._waiters = [w for w in self._waiters if not w[1].done()]
+            if self._waiters:
+                loop.call_later(self.poll_interval / 1000, poll)
+            else:
+                self._polling = False
+
+        loop.call_later(self.poll_interval / 1000, poll)
+
+    def __aiter__(self):
+        """
+        Returns a new asynchronous iterator over the events recorded from now
+        on. Each iterator (each ``async for`` loop) sees every event.
+        """
+        return _ButtonEventIterator(self)
 
     @property
     def buttons_pressed(self):
         raise NotImplementedError()
 
 
+class _ButtonEventIterator(object):
+    """
+    Asynchronous iterator over the events of a `ButtonBase`, with its own
+    position in the event queue.
+    """
+
+    def __init__(self, buttons):
+        self._buttons = buttons
+        self._count = buttons._event_count
+
+    def _next_event(self):
+        pending = self._buttons._events_after(self._count)
+        if not pending:
+            return None
+        self._count = self._buttons._event_count - len(pending) + 1
+        return pending[0]
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        """
+        Returns an ``asyncio.Future`` that resolves to the next `ButtonEvent`.
+        """
+        # asyncio takes a while to import on the EV3, so only do it if needed.
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        future = asyncio.Future(loop=loop)
+
+        buttons = self._buttons
+        waiting = buttons._waiters and any(
+                iterator is self and not f.done() for iterator, f in buttons._waiters)
+        if not waiting:
+            # Only take an event directly when no earlier call on this
+            # iterator is waiting, so that the events are delivered in order.
+            event = self._next_event()
+            if event is not None:
+                future.set_result(event)
+                return future
+
+        if buttons._waiters is None:
+            buttons._waiters = []
+        buttons._waiters.append((self, future))
+        buttons._watch(loop)
+        return future
+
+
 class ButtonEVIO(ButtonBase):
 
     """
@@ -2642,22 +3558,68 @@ class ButtonEVIO(ButtonBase):
     This implementation depends on the availability of the EVIOCGKEY ioctl
     to be able to read the button state buffer. See Linux kernel source
     in /include/uapi/linux/input.h for details.
+
+    Instead of polling with `process()`, the input events sent by the kernel
+    can be used: `process_events()` waits for events and calls the handlers
+    for each of them, and `attach()` has an asyncio event loop do the same.
+    No CPU time is used while no button is touched. During a handler call,
+    `event_time` holds the kernel timestamp of the event. The kernel
+    debounces these events itself, so `debounce` only applies to polling.
+
+    Example::
+
+        btn = Button()
+        btn.on_enter = lambda state: print('enter', state, btn.event_time)
+        while True:
+            btn.process_events()
     """
 
     KEY_MAX = 0x2FF
     KEY_BUF_LEN = int((KEY_MAX + 7) / 8)
     EVIOCGKEY = (2 << (14 + 8 + 8) | KEY_BUF_LEN << (8 + 8) | ord('E') << 8 | 0x18)
 
+    # struct input_event: struct timeval time; __u16 type; __u16 code; __s32 value;
+    _INPUT_EVENT = Struct('llHHi')
+    _EV_SYN = 0
+    _EV_KEY = 1
+    _SYN_DROPPED = 3
+
     _buttons = {}
 
+    # Number of key states remembered by _pressed().
+    _PRESSED_CACHE_SIZE = 64
+
     def __init__(self):
         self._file_cache = {}
         self._buffer_cache = {}
+        self._key_codes = {}
+        key_masks = {}
         for b in self._buttons:
             name = self._buttons[b]['name']
             if name not in self._file_cache:
                 self._file_cache[name] = open(name, 'rb', 0)
                 self._buffer_cache[name] = array.array('B', [0] * self.KEY_BUF_LEN)
+                self._key_codes[name] = {}
+                key_masks[name] = []
+            bit = self._buttons[b]['value']
+            self._key_codes[name][bit] = b
+            key_masks[name].append((bit >> 3, 1 << (bit & 7), b))
+
+        # (file, key state buffer, ((byte offset, mask, button), ...)) for
+        # each input device.
+        self._key_tables = tuple(
+                (self._file_cache[name], self._buffer_cache[name], tuple(masks))
+                for name, masks in key_masks.items())
+
+        # Sets of pressed buttons, keyed by the raw key state.
+        self._pressed_cache = {}
+        self._last_raw = None
+        self._last_pressed = frozenset()
+
+        #: Kernel timestamp (seconds since the epoch) of the event being handled.
+        self.event_time = None
+
+        self._event_loop = None
 
     def _button_file(self, name):
         return self._file_cache[name]
@@ -2665,21 +3627,129 @@ class ButtonEVIO(ButtonBase):
     def _button_buffer(self, name):
         return self._buffer_cache[name]
 
+    def _pressed(self):
+        """
+        Reads the key state of the input devices and returns the set of
+        pressed buttons. The set is only computed for key states that were
+        not seen recently.
+        """
+        tables = self._key_tables
+        for f, buf, masks in tables:
+            fcntl.ioctl(f, self.EVIOCGKEY, buf)
+
+        if len(tables) == 1:
+            raw = tables[0][1].tobytes()
+        else:
+            raw = b''.join(buf.tobytes() for f, buf, masks in tables)
+
+        if raw == self._last_raw:
+            return self._last_pressed
+
+        pressed = self._pressed_cache.get(raw)
+        if pressed is None:
+            pressed = frozenset(button
+                    for f, buf, masks in tables
+                    for offset, mask, button in masks
+                    if buf[offset] & mask)
+
+            if len(self._pressed_cache) >= self._PRESSED_CACHE_SIZE:
+                self._pressed_cache.clear()
+            self._pressed_cache[raw] = pressed
+
+        self._last_raw = raw
+        self._last_pressed = pressed
+        return pressed
+
     @property
     def buttons_pressed(self):
         """
         Returns list of names of pressed buttons.
         """
-        for b in self._buffer_cache:
-            fcntl.ioctl(self._button_file(b), self.EVIOCGKEY, self._buffer_cache[b])
+        return list(self._pressed())
 
-        pressed = []
-        for k, v in self._buttons.items():
-            buf = self._buffer_cache[v['name']]
-            bit = v['value']
-            if bool(buf[int(bit / 8)] & 1 << bit % 8):
-                pressed += [k]
-        return pressed
+    def _read_events(self, name):
+        """
+        Reads the pending events of an input device and calls the handlers.
+        """
+        size = self._INPUT_EVENT.size
+        data = os.read(self._file_cache[name].fileno(), size * 64)
+        codes = self._key_codes[name]
+
+        for offset in range(0, len(data) - size + 1, size):
+            sec, usec, ev_type, code, value = self._INPUT_EVENT.unpack_from(data, offset)
+
+            if ev_type == self._EV_KEY:
+                # value is 0 on release, 1 on press and 2 on autorepeat.
+                button = codes.get(code)
+                if button is None or value == 2:
+                    continue
+
+                state = value == 1
+                if state == (button in self._state):
+                    continue
+
+                # The kernel debounces the key events already, and a dropped
+                # release would never be followed by another one.
+                self.event_time = sec + usec / 1000000.0
+                self._record(self.event_time, button, state, debounce=False)
+
+                self._state = frozenset(self._state) ^ frozenset([button])
+                self._dispatch([(button, state)])
+
+            elif ev_type == self._EV_SYN and code == self._SYN_DROPPED:
+                # The kernel buffer overflowed and events were lost: catch
+                # up with the current state.
+                self.event_time = sec + usec / 1000000.0
+                self.process()
+
+    def process_events(self, timeout=None):
+        """
+        Waits for button events and calls the button event handlers for each
+        of them, like `process()` does for state changes. Returns ``False``
+        if nothing happened within ``timeout`` milliseconds, ``True`` otherwise.
+        """
+        files = list(self._file_cache.values())
+        ready, _, _ = select.select(files, [], [],
+                None if timeout is None else timeout / 1000)
+
+        for f in ready:
+            self._read_events(f.name)
+
+        return bool(ready)
+
+    def _wait_events(self, timeout):
+        self.process_events(timeout)
+
+    def _watch(self, loop):
+        if self._event_loop is None:
+            self.attach(loop)
+
+    def attach(self, loop=None):
+        """
+        Makes an asyncio event loop call the button event handlers whenever
+        button events arrive, until `detach()` is called.
+        """
+        # asyncio takes a while to import on the EV3, so only do it if needed.
+        import asyncio
+
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        self.detach()
+        for name, f in self._file_cache.items():
+            loop.add_reader(f.fileno(), self._read_events, name)
+        self._event_loop = loop
+
+    def detach(self):
+        """
+        Stops the event loop given to `attach()` from handling button events.
+        """
+        if self._event_loop is None:
+            return
+
+        for f in self._file_cache.values():
+            self._event_loop.remove_reader(f.fileno())
+        self._event_loop = None
 
 
 # ~autogen remote-control specialSensorTypes.infraredSensor.remoteControl>currentClass
@@ -2757,17 +3827,31 @@ class RemoteControl(ButtonBase):
 
 # ~autogen
 
-    def __init__(self, sensor=None, channel=1):
-        if sensor is None:
+    def __init__(self, sensor=None, channel=1, hub=None):
+        """
+        Parameters:
+            sensor: the `InfraredSensor` to use. A new one is created when
+                neither ``sensor`` nor ``hub`` is given.
+            channel: channel of the remote control (1 to 4).
+            hub: an `InfraredHub` in ``IR-REMOTE`` mode to get the button
+                state from, instead of reading the sensor. The hub reads
+                the sensor again when its values are older than its
+                ``max_age``.
+        """
+        if hub is not None:
+            hub._require_mode('IR-REMOTE')
+            self._sensor = hub.sensor
+        elif sensor is None:
             self._sensor = InfraredSensor()
         else:
             self._sensor = sensor
 
+        self._hub = hub
         self._channel = max(1, min(4, channel)) - 1
         self._state = set([])
 
-        if self._sensor.connected:
-            self._sensor.mode = 'IR-REMOTE'
+        if hub is None and self._sensor.connected:
+            self._sensor._switch_mode('IR-REMOTE')
 
     @property
     def connected(self):
@@ -2778,7 +3862,11 @@ class RemoteControl(ButtonBase):
         """
         Returns list of currently pressed buttons.
         """
-        return RemoteControl._BUTTON_VALUES.get(self._sensor.value(self._channel), [])
+        if self._hub is not None:
+            value = self._hub.value(self._channel)
+        else:
+            value = self._sensor.value(self._channel)
+        return RemoteControl._BUTTON_VALUES.get(value, [])
 
 
 class BeaconSeeker(object):
@@ -2786,19 +3874,40 @@ class BeaconSeeker(object):
     Seeks EV3 Remote Controller in beacon mode.
     """
 
-    def __init__(self, sensor=None, channel=1):
-        self._sensor  = InfraredSensor() if sensor is None else sensor
+    def __init__(self, sensor=None, channel=1, hub=None):
+        """
+        Parameters:
+            sensor: the `InfraredSensor` to use. A new one is created when
+                neither ``sensor`` nor ``hub`` is given.
+            channel: channel of the beacon (1 to 4).
+            hub: an `InfraredHub` in ``IR-SEEK`` mode to get the values
+                from, instead of reading the sensor. The hub reads the
+                sensor again when its values are older than its
+                ``max_age``.
+        """
+        if hub is not None:
+            hub._require_mode('IR-SEEK')
+            self._sensor = hub.sensor
+        else:
+            self._sensor = InfraredSensor() if sensor is None else sensor
+
+        self._hub     = hub
         self._channel = max(1, min(4, channel)) - 1
 
-        if self._sensor.connected:
-            self._sensor.mode = 'IR-SEEK'
+        if hub is None and self._sensor.connected:
+            self._sensor._switch_mode('IR-SEEK')
+
+    def _value(self, n):
+        if self._hub is not None:
+            return self._hub.value(n)
+        return self._sensor.value(n)
 
     @property
     def heading(self):
         """
         Returns heading (-25, 25) to the beacon on the given channel.
         """
-        return self._sensor.value(self._channel * 2)
+        return self._value(self._channel * 2)
 
     @property
     def distance(self):
@@ -2806,7 +3915,7 @@ class BeaconSeeker(object):
         Returns distance (0, 100) to the beacon on the given channel.
         Returns -128 when beacon is not found.
         """
-        return self._sensor.value(self._channel * 2 + 1)
+        return self._value(self._channel * 2 + 1)
 
     @property
     def heading_and_distance(self):
@@ -2814,7 +3923,114 @@ class BeaconSeeker(object):
         Returns heading and distance to the beacon on the given channel as a
         tuple.
         """
-        return self._sensor.value(self._channel * 2), self._sensor.value(self._channel * 2 + 1)
+        return self._value(self._channel * 2), self._value(self._channel * 2 + 1)
+
+
+class InfraredHub(object):
+    """
+    Reads the values of all four channels of an `InfraredSensor` at once,
+    and shares them between `RemoteControl` and `BeaconSeeker` objects.
+
+    Each call to `update()` reads all the values with a single read of
+    `bin_data`, so a robot listening to several channels costs one system
+    call per loop instead of one per channel, and all channels are sampled
+    at the same moment. The sensor can only be in one mode: a hub in
+    ``IR-REMOTE`` mode serves remote controls, one in ``IR-SEEK`` mode serves
+    beacon seekers.
+
+    The objects attached to the hub use the values of the last `update()`
+    as long as they are not older than ``max_age`` milliseconds, and
+    trigger a new `update()` otherwise. So they keep working when polled
+    on their own, and calling `update()` (or `process()`) once per loop
+    makes all of them share a single read.
+
+    Example::
+
+        hub = InfraredHub()
+        remotes = [hub.remote(channel) for channel in (1, 2, 3, 4)]
+
+        while True:
+            hub.process()
+            time.sleep(0.01)
+    """
+
+    def __init__(self, sensor=None, mode='IR-REMOTE', max_age=10):
+        """
+        Parameters:
+            sensor: the `InfraredSensor` to use. A new one is created when
+                not given.
+            mode: ``IR-REMOTE`` or ``IR-SEEK``.
+            max_age: age in milliseconds after which `value()` reads new
+                values from the sensor.
+        """
+        if mode not in ('IR-REMOTE', 'IR-SEEK'):
+            raise ValueError('Unsupported mode: %s' % mode)
+
+        self.sensor = InfraredSensor() if sensor is None else sensor
+        self.mode = mode
+        self.max_age = max_age
+
+        #: Values of all channels from the last `update()`.
+        self.values = None
+
+        #: Time of the last `update()`, as returned by ``time.monotonic()``.
+        self.timestamp = None
+
+        self._remotes = []
+
+        if self.sensor.connected:
+            self.sensor._switch_mode(mode)
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def _require_mode(self, mode):
+        if mode != self.mode:
+            raise Exception('%s is in %s mode, %s is needed' % (self, self.mode, mode))
+
+    def update(self):
+        """
+        Reads the values of all channels from the sensor.
+        """
+        self.values = self.sensor.bin_data_values()
+        self.timestamp = time.monotonic()
+        return self.values
+
+    def value(self, n):
+        """
+        Returns value ``n`` from the last `update()`. Calls `update()` first
+        when nothing was read yet, or when the values are older than
+        ``max_age``.
+        """
+        values = self.values
+        if values is None or (time.monotonic() - self.timestamp) * 1000 > self.max_age:
+            values = self.update()
+        return values[n]
+
+    def remote(self, channel=1):
+        """
+        Returns a `RemoteControl` for the given channel that gets its button
+        state from this hub. `process()` processes it along with the others.
+        """
+        rc = RemoteControl(channel=channel, hub=self)
+        self._remotes.append(rc)
+        return rc
+
+    def seeker(self, channel=1):
+        """
+        Returns a `BeaconSeeker` for the given channel that gets its values
+        from this hub.
+        """
+        return BeaconSeeker(channel=channel, hub=self)
+
+    def process(self):
+        """
+        Calls `update()`, then `RemoteControl.process()` for each of the
+        remote controls created by `remote()`.
+        """
+        self.update()
+        for rc in self._remotes:
+            rc.process()
 
 
 # ~autogen generic-class classes.powerSupply>currentClass
@@ -3056,6 +4272,230 @@ class LegoPort(Device):
 
 # ~autogen
 
+class DeviceRegistry(object):
+    """
+    Keeps a live map of the devices plugged into the brick, and calls the
+    provided handlers when a device is connected or disconnected.
+
+    The registry listens to kernel uevents on a netlink socket, and rescans
+    the affected device class whenever one arrives. When the socket is not
+    available, the device classes are rescanned every ``poll_interval``
+    seconds instead (sysfs does not report device nodes coming and going
+    through inotify).
+
+    Handlers are called as ``on_connect(address, device)`` and
+    ``on_disconnect(address, device)``. They are called from the background
+    thread, except for the devices found by the initial scan in `start()`.
+    Disconnected devices have their `connected` attribute set to ``False``.
+
+    Example::
+
+        def rebind(address, device):
+            print('%s is back on %s' % (device.driver_name, address))
+
+        registry = DeviceRegistry(on_connect=rebind)
+        registry.start()
+        motor = registry.get('outA')
+    """
+
+    #: Device classes watched by default, and the classes used to represent
+    #: their devices.
+    CLASSES = {
+            'tacho-motor':  Motor,
+            'lego-sensor':  Sensor,
+            'dc-motor':     DcMotor,
+            'servo-motor':  ServoMotor,
+            'lego-port':    LegoPort,
+            }
+
+    _NETLINK_KOBJECT_UEVENT = 15
+
+    def __init__(self, classes=None, on_connect=None, on_disconnect=None, poll_interval=1.0):
+        """
+        Parameters:
+            classes: names of the device classes to watch. Defaults to all
+                of `CLASSES`.
+            on_connect: handler called when a device is connected.
+            on_disconnect: handler called when a device is disconnected.
+            poll_interval: rescan period in seconds, used when kernel
+                uevents are not available.
+        """
+        self.classes = list(self.CLASSES) if classes is None else list(classes)
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._thread = None
+        self._stop = None
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def start(self):
+        """
+        Scans for the devices present right now and starts watching for
+        changes in a background thread.
+        """
+        if self._thread is not None:
+            return
+
+        uevents = self._open_uevents()
+        pending = False
+        for class_name in self.classes:
+            pending = self._scan(class_name) or pending
+
+        self._stop = os.pipe()
+        self._thread = threading.Thread(target=self._run, args=(uevents, pending))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread.
+        """
+        if self._thread is None:
+            return
+
+        os.write(self._stop[1], b'x')
+        self._thread.join()
+        for fd in self._stop:
+            os.close(fd)
+        self._thread = None
+        self._stop = None
+
+    @property
+    def devices(self):
+        """
+        Returns a dict of the connected devices keyed by their address.
+        Ports are not included.
+        """
+        with self._lock:
+            return dict((address, device)
+                    for class_name, address, device in self._devices.values()
+                    if class_name != 'lego-port')
+
+    def get(self, address, class_name=None):
+        """
+        Returns the device connected to the given address, or ``None``.
+        When ``class_name`` is given, only devices of that class are
+        considered, which is the way to look up a `LegoPort`.
+        """
+        with self._lock:
+            for c, a, device in self._devices.values():
+                if a == address and (c == class_name or
+                        class_name is None and c != 'lego-port'):
+                    return device
+        return None
+
+    def _open_uevents(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                    DeviceRegistry._NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))
+            return sock
+        except (AttributeError, OSError):
+            return None
+
+    def _run(self, uevents, pending):
+        watch = [self._stop[0]]
+        if uevents is not None:
+            watch.append(uevents)
+
+        try:
+            while True:
+                # Without uevents, or while some devices are still being set
+                # up, fall back to rescanning periodically.
+                if uevents is None or pending:
+                    timeout = self.poll_interval
+                else:
+                    timeout = None
+
+                ready, _, _ = select.select(watch, [], [], timeout)
+
+                if self._stop[0] in ready:
+                    break
+
+                changed = self.classes
+                if uevents in ready:
+                    try:
+                        changed = self._changed_classes(uevents.recv(8192))
+                    except Exception:
+                        # E.g. ENOBUFS when events were lost: rescan everything.
+                        log.exception('%s: failed to read uevents', self)
+
+                pending = False
+                for class_name in changed:
+                    # Keep watching the other classes (and later events) when
+                    # something goes wrong with one of them.
+                    try:
+                        pending = self._scan(class_name) or pending
+                    except Exception:
+                        log.exception('%s: failed to scan %s devices', self, class_name)
+                        pending = True
+        finally:
+            if uevents is not None:
+                uevents.close()
+
+    def _changed_classes(self, message):
+        for field in message.split(b'\0'):
+            if field.startswith(b'SUBSYSTEM='):
+                class_name = field[10:].decode()
+                return [class_name] if class_name in self.classes else []
+        return []
+
+    def _scan(self, class_name):
+        """Synchronizes the map with the given device class. Returns True
+        if some of the new devices could not be added yet."""
+        class_path = abspath(Device.DEVICE_ROOT_PATH + '/' + class_name)
+        try:
+            names = set(os.listdir(class_path))
+        except OSError:
+            names = set()
+
+        with self._lock:
+            known = set(name for (c, name) in self._devices if c == class_name)
+
+        for name in known.difference(names):
+            with self._lock:
+                _, address, device = self._devices.pop((class_name, name))
+            device.connected = False
+            self._notify(self.on_disconnect, address, device)
+
+        pending = False
+        for name in names.difference(known):
+            cls = self.CLASSES.get(class_name)
+            try:
+                if cls is None:
+                    device = Device(class_name, name, name_exact=True)
+                else:
+                    device = cls(name_pattern=name, name_exact=True)
+
+                _, address = device.get_attr_string(None, 'address')
+            except OSError:
+                # The device is still being set up, pick it up on next scan.
+                pending = True
+                continue
+            except Exception:
+                log.exception('%s: failed to add %s/%s', self, class_name, name)
+                pending = True
+                continue
+
+            with self._lock:
+                self._devices[(class_name, name)] = (class_name, address, device)
+            self._notify(self.on_connect, address, device)
+
+        return pending
+
+    def _notify(self, handler, address, device):
+        if handler is None:
+            return
+        try:
+            handler(address, device)
+        except Exception:
+            log.exception('%s: %s handler failed for %s', self, handler.__name__, address)
+
 class FbMem(object):
 
     """The framebuffer memory object.
@@ -26,7 +26,11 @@
 An assortment of classes modeling specific features of the EV3 brick.
 """
 
+import os
+import threading
+
 from .core import *
+from .control import Loop
 
 
 OUTPUT_A = 'outA'
@@ -102,6 +106,181 @@ class Leds(object):
 
 # ~autogen
 
+class LedAnimator(object):
+    """
+    Plays LED animations from a background thread.
+
+    An animation is a sequence of frames, each frame holding one brightness
+    (0 to 1) per LED. The frames are converted to the values written to the
+    LEDs when the animation is given to `play()`, and a value is only
+    written when it differs from the previous one. A single thread, paced by
+    a `Loop`, plays the animation, so the caller is free to do other work.
+
+    Blinking does not need the thread at all: `blink()` hands it over to the
+    ``timer`` trigger of the kernel.
+
+    Example::
+
+        animator = LedAnimator()
+
+        # Fade both sides from green to red and back, over and over.
+        there = LedAnimator.fade(LedAnimator.color_frame(Leds.GREEN, Leds.GREEN),
+                                 LedAnimator.color_frame(Leds.RED, Leds.RED), 20)
+        animator.play(there + there[::-1], repeat=True)
+        ...
+        animator.blink(Leds.LEFT, Leds.AMBER, 250, 250)
+    """
+
+    def __init__(self, leds=None, rate=20):
+        """
+        Parameters:
+            leds: the LEDs to animate, in the order of the values in the
+                frames. Defaults to ``Leds.LEFT + Leds.RIGHT``, which matches
+                `color_frame()`.
+            rate: number of frames per second.
+        """
+        self.leds = Leds.LEFT + Leds.RIGHT if leds is None else tuple(leds)
+        self.rate = rate
+
+        self._max = [led.max_brightness for led in self.leds]
+
+        # The thread writes through its own descriptors with os.pwrite(), so
+        # that it does not share a file offset with the Led objects.
+        self._files = []
+        for led in self.leds:
+            self._files.append(os.open(led._path + '/brightness', os.O_WRONLY))
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._frames = None
+        self._repeat = False
+        self._start = None
+        self._written = [None] * len(self.leds)
+        self._timer_leds = set()
+
+    @staticmethod
+    def color_frame(left=Leds.BLACK, right=Leds.BLACK):
+        """
+        Returns the frame showing the given colors (see `Leds`) on the left
+        and right side, for an animator using the default LEDs.
+        """
+        return tuple(left) + tuple(right)
+
+    @staticmethod
+    def fade(start, end, steps):
+        """
+        Returns a list of ``steps`` frames going from frame ``start`` to frame
+        ``end`` (both included).
+        """
+        if steps < 2:
+            return [tuple(end)]
+        return [tuple(a + (b - a) * i / (steps - 1) for a, b in zip(start, end))
+                for i in range(steps)]
+
+    def play(self, frames, repeat=False):
+        """
+        Starts playing the frames, replacing the current animation. When
+        ``repeat`` is ``True``, the animation is played until `stop()` is
+        called.
+        """
+        encoded = tuple(
+                tuple(Device._encode_int(round(min(max(v, 0), 1) * m)) for v, m in zip(frame, self._max))
+                for frame in frames)
+
+        self._stop_timers()
+
+        with self._lock:
+            self._frames = encoded
+            self._repeat = repeat
+            self._start = None
+            self._written = [None] * len(self.leds)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(Loop(1000.0 / self.rate),))
+                self._thread.daemon = True
+                self._thread.start()
+
+    def blink(self, group, color, delay_on, delay_off):
+        """
+        Stops the animation and makes the LEDs of ``group`` blink with the
+        given color, using the ``timer`` trigger of the kernel. ``delay_on``
+        and ``delay_off`` are in milliseconds.
+
+        Example::
+
+            animator.blink(Leds.LEFT, Leds.RED, 100, 900)
+        """
+        self.stop()
+
+        for led, v in zip(group, color):
+            if v:
+                led.trigger = 'timer'
+                led.delay_on = delay_on
+                led.delay_off = delay_off
+                led.brightness_pct = v
+                self._timer_leds.add(led)
+            else:
+                if led in self._timer_leds:
+                    led.trigger = 'none'
+                    self._timer_leds.discard(led)
+                led.brightness = 0
+
+    def stop(self):
+        """
+        Stops the animation. The LEDs keep their current brightness.
+        """
+        with self._lock:
+            thread = self._thread
+            self._frames = None
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def wait(self):
+        """
+        Waits until an animation played without ``repeat`` is finished.
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def __del__(self):
+        for fd in getattr(self, '_files', ()):
+            os.close(fd)
+
+    def _stop_timers(self):
+        for led in self._timer_leds:
+            led.trigger = 'none'
+        self._timer_leds.clear()
+
+    def _run(self, loop):
+        files = self._files
+
+        for tick in loop:
+            with self._lock:
+                frames = self._frames
+                if frames is not None:
+                    if self._start is None:
+                        self._start = tick
+                    n = tick - self._start
+                    if n >= len(frames):
+                        if self._repeat and frames:
+                            n %= len(frames)
+                        else:
+                            frames = self._frames = None
+
+                if frames is None:
+                    self._thread = None
+                    break
+
+                frame = frames[n]
+                written = self._written
+
+            for i, data in enumerate(frame):
+                if data != written[i]:
+                    os.pwrite(files[i], data, 0)
+                    written[i] = data
+
 class Button(ButtonEVIO):
     """
     EV3 Buttons
@@ -178,42 +357,42 @@ class Button(ButtonEVIO):
         """
         Check if 'up' button is pressed.
         """
-        return 'up' in self.buttons_pressed
+        return 'up' in self._pressed()
 
     @property
     def down(self):
         """
         Check if 'down' button is pressed.
         """
-        return 'down' in self.buttons_pressed
+        return 'down' in self._pressed()
 
     @property
     def left(self):
         """
         Check if 'left' button is pressed.
         """
-        return 'left' in self.buttons_pressed
+        return 'left' in self._pressed()
 
     @property
     def right(self):
         """
         Check if 'right' button is pressed.
         """
-        return 'right' in self.buttons_pressed
+        return 'right' in self._pressed()
 
     @property
     def enter(self):
         """
         Check if 'enter' button is pressed.
         """
-        return 'enter' in self.buttons_pressed
+        return 'enter' in self._pressed()
 
     @property
     def backspace(self):
         """
         Check if 'backspace' button is pressed.
         """
-        return 'backspace' in self.buttons_pressed
+        return 'backspace' in self._pressed()
 
 
 # ~autogen
@@ -0,0 +1,159 @@
+"""
+Small signal filters for control loops.
+
+All filters keep their state in preallocated buffers, so calling
+``update()`` does not allocate any memory. They are meant to be called on
+every iteration of a control loop running at 100-200 Hz.
+"""
+
+from array import array
+from bisect import bisect_left, insort
+
+
+class MovingAverage(object):
+    """
+    Mean of the last ``size`` values.
+
+    Example::
+
+        speed = MovingAverage(5)
+        for tick in Loop(10):
+            s = speed.update(motor.speed)
+    """
+
+    def __init__(self, size, value=0.0):
+        """
+        Parameters:
+            size: number of values to average.
+            value: initial contents of the window.
+        """
+        self.size = size
+        self.value = value
+        self._buffer = array('d', [value] * size)
+        self._index = 0
+        self._sum = value * size
+
+    def update(self, x):
+        """Adds a value and returns the mean of the window."""
+        buffer = self._buffer
+        i = self._index
+        self._sum += x - buffer[i]
+        buffer[i] = x
+        i += 1
+        if i == self.size:
+            i = 0
+            # Start over from the exact sum once per window, so that
+            # rounding errors do not pile up.
+            self._sum = sum(buffer)
+        self._index = i
+        self.value = self._sum / self.size
+        return self.value
+
+
+class MedianFilter(object):
+    """
+    Median of the last ``size`` values. Good at removing single bad
+    readings (spikes) from a sensor signal.
+    """
+
+    def __init__(self, size, value=0.0):
+        """
+        Parameters:
+            size: number of values in the window. Should be odd.
+            value: initial contents of the window.
+        """
+        self.size = size
+        self.value = value
+        self._buffer = array('d', [value] * size)
+        self._sorted = array('d', [value] * size)
+        self._index = 0
+
+    def update(self, x):
+        """Adds a value and returns the median of the window."""
+        buffer = self._buffer
+        ordered = self._sorted
+        i = self._index
+
+        del ordered[bisect_left(ordered, buffer[i])]
+        insort(ordered, x)
+
+        buffer[i] = x
+        i += 1
+        self._index = 0 if i == self.size else i
+
+        self.value = ordered[self.size // 2]
+        return self.value
+
+
+class KalmanFilter(object):
+    """
+    One dimensional Kalman filter for a value that follows a random walk,
+    measured with noise.
+
+    The ratio of the two variances sets how much the measurements are
+    smoothed: a small ``process_variance`` compared to
+    ``measurement_variance`` gives a smooth but slow estimate.
+    """
+
+    def __init__(self, process_variance, measurement_variance, value=0.0, variance=1.0):
+        """
+        Parameters:
+            process_variance: variance of the change of the value per update.
+            measurement_variance: variance of the measurement noise.
+            value: initial estimate.
+            variance: variance of the initial estimate.
+        """
+        self.process_variance = process_variance
+        self.measurement_variance = measurement_variance
+        self.value = value
+        self.variance = variance
+
+    def update(self, z):
+        """Adds the measurement ``z`` and returns the new estimate."""
+        p = self.variance + self.process_variance
+        k = p / (p + self.measurement_variance)
+        self.value += k * (z - self.value)
+        self.variance = (1 - k) * p
+        return self.value
+
+
+class ComplementaryFilter(object):
+    """
+    Estimates an angle from an angular rate and a (noisy, but drift-free)
+    measurement of the angle itself.
+
+    The rate is integrated, which is accurate over short times, and the
+    result is pulled towards the measured angle with the given time
+    constant, which removes the drift of the integration. Without a time
+    constant, the filter just integrates the rate.
+
+    When no angle measurement is available, the angle is pulled towards
+    zero: this suits a balancing robot, which stays upright on average.
+    """
+
+    def __init__(self, time_constant=None, value=0.0):
+        """
+        Parameters:
+            time_constant: time in seconds over which the angle is trusted
+                more than the integrated rate. ``None`` turns off the
+                correction.
+            value: initial angle.
+        """
+        self.time_constant = time_constant
+        self.value = value
+        self._dt = None
+        self._alpha = 1.0
+
+    def update(self, rate, dt, angle=0.0):
+        """
+        Integrates ``rate`` over ``dt`` seconds, corrects the result with
+        ``angle`` and returns the new estimate.
+        """
+        if dt != self._dt:
+            self._dt = dt
+            tau = self.time_constant
+            self._alpha = 1.0 if tau is None else tau / (tau + dt)
+
+        a = self._alpha
+        self.value = a * (self.value + rate * dt) + (1 - a) * angle
+        return self.value
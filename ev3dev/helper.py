@@ -10,6 +10,7 @@ import ev3dev.auto
 from ev3dev.auto import (RemoteControl, list_motors,
                          INPUT_1, INPUT_2, INPUT_3, INPUT_4,
                          OUTPUT_A, OUTPUT_B, OUTPUT_C, OUTPUT_D)
+from ev3dev.control import Loop
 from time import sleep
 
 log = logging.getLogger(__name__)
@@ -230,9 +231,8 @@ class RemoteControlledTank(Tank):
     def main(self):
 
         try:
-            while True:
+            for tick in Loop(10):
                 self.remote.process()
-                time.sleep(0.01)
 
         # Exit cleanly so that all motors are stopped
         except (KeyboardInterrupt, Exception) as e:
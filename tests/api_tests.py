@@ -13,7 +13,16 @@ import ev3dev.core as ev3
 
 ev3.Device.DEVICE_ROOT_PATH = os.path.join(FAKE_SYS, 'arena')
 
+def overwrite(device, name, value):
+    """Changes an attribute of the fake device behind the back of the API."""
+    with open(os.path.join(device._path, name), 'w') as f:
+        f.write(value)
+
 class TestAPI(unittest.TestCase):
+    def setUp(self):
+        # Every test recreates the arena devices under the same names.
+        ev3.Device._written_values.clear()
+
     def test_device(self):
         clean_arena()
         populate_arena({'medium_motor' : [0, 'outA'], 'infrared_sensor' : [0, 'in1']})
@@ -39,6 +48,35 @@ class TestAPI(unittest.TestCase):
         d = ev3.Device('this-does-not-exist')
         self.assertFalse(d.connected)
 
+    def test_device_index(self):
+        import shutil
+
+        clean_arena()
+        populate_arena({'medium_motor' : [0, 'outA'], 'large_motor' : [1, 'outB']})
+        ev3.invalidate_device_index()
+
+        classpath = os.path.join(ev3.Device.DEVICE_ROOT_PATH, 'tacho-motor')
+
+        def names(**kwargs):
+            return sorted(ev3.list_device_names(classpath, 'motor*', **kwargs))
+
+        self.assertEqual(names(), ['motor0', 'motor1'])
+        self.assertEqual(sorted(ev3._discovery_index[classpath]), ['motor0', 'motor1'])
+
+        # Identity attributes are read once and then served from the index.
+        self.assertEqual(names(address='outB'), ['motor1'])
+        overwrite(ev3.Device('tacho-motor', 'motor1', name_exact=True), 'address', 'outC')
+        self.assertEqual(names(address='outB'), ['motor1'])
+        self.assertEqual(names(address='outC'), [])
+
+        ev3.invalidate_device_index('tacho-motor')
+        self.assertEqual(names(address='outC'), ['motor1'])
+
+        # Devices that are gone are dropped from the index.
+        shutil.rmtree(os.path.join(classpath, 'motor1'))
+        self.assertEqual(names(), ['motor0'])
+        self.assertEqual(list(ev3._discovery_index[classpath]), ['motor0'])
+
     def test_medium_motor(self):
         def dummy(self):
             pass
@@ -48,6 +86,7 @@ class TestAPI(unittest.TestCase):
 
         # Do not write motor.command on exit (so that fake tree stays intact)
         ev3.MediumMotor.__del__ = dummy
+        self.addCleanup(delattr, ev3.MediumMotor, '__del__')
 
         m = ev3.MediumMotor()
 
@@ -78,6 +117,148 @@ class TestAPI(unittest.TestCase):
         with self.assertRaises(Exception):
             c = m.command
 
+        self.assertEqual(m.read_many(('position', 'speed', 'state')), ('42', '0', 'running'))
+        self.assertEqual(m.snapshot(), (42, 0, ['running'], 0))
+
+    def test_setpoint_coalescing(self):
+        clean_arena()
+        populate_arena({'medium_motor' : [0, 'outA']})
+
+        m = ev3.MediumMotor()
+
+        m.run_forever(speed_sp=100)
+        self.assertEqual(m.speed_sp, 100)
+
+        # The same setpoint is not written again...
+        overwrite(m, 'speed_sp', '7')
+        m.run_forever(speed_sp=100)
+        self.assertEqual(m.speed_sp, 7)
+
+        # ...unless asked to,
+        m.run_forever(speed_sp=100, force=True)
+        self.assertEqual(m.speed_sp, 100)
+
+        # and a different value is always written.
+        m.run_forever(speed_sp=200)
+        self.assertEqual(m.speed_sp, 200)
+
+        # reset() makes the motor forget the written setpoints.
+        m.reset()
+        overwrite(m, 'speed_sp', '7')
+        m.run_forever(speed_sp=200)
+        self.assertEqual(m.speed_sp, 200)
+
+    def test_setpoints_shared_per_port(self):
+        clean_arena()
+        populate_arena({'medium_motor' : [0, 'outA']})
+
+        a = ev3.MediumMotor()
+        b = ev3.MediumMotor()
+
+        a.run_forever(speed_sp=100)
+        b.run_forever(speed_sp=200)
+        a.run_forever(speed_sp=100)
+        self.assertEqual(a.speed_sp, 100)
+
+        # reset() through one object is seen by the other.
+        b.reset()
+        overwrite(a, 'speed_sp', '7')
+        a.run_forever(speed_sp=100)
+        self.assertEqual(a.speed_sp, 100)
+
+    def test_motor_group(self):
+        clean_arena()
+        populate_arena({'medium_motor' : [0, 'outA'], 'large_motor' : [1, 'outB']})
+
+        a = ev3.MediumMotor()
+        b = ev3.LargeMotor()
+        g = ev3.MotorGroup(a, b)
+
+        # Lists give a value per motor, other values go to all of them.
+        g.run_timed(speed_sp=[100, -100], time_sp=2000)
+        self.assertEqual((a.speed_sp, b.speed_sp), (100, -100))
+        self.assertEqual((a.time_sp, b.time_sp), (2000, 2000))
+
+        # The command is written to every motor, and timed.
+        self.assertEqual(g.command_count, 1)
+        self.assertTrue(g.last_skew >= 0)
+        g.stop()
+        self.assertEqual(g.command_count, 2)
+        self.assertTrue(g.max_skew >= g.last_skew)
+
+        # Setpoints go through the per-motor record.
+        overwrite(b, 'speed_sp', '7')
+        g.run_forever(speed_sp=[100, -100])
+        self.assertEqual(b.speed_sp, 7)
+        g.run_forever(speed_sp=[100, -100], force=True)
+        self.assertEqual(b.speed_sp, -100)
+
+    def test_raw_fd_backend(self):
+        clean_arena()
+        populate_arena({'medium_motor' : [0, 'outA'], 'infrared_sensor' : [0, 'in1']})
+
+        ev3.Device.RAW_FD = True
+        try:
+            m = ev3.MediumMotor()
+            s = ev3.InfraredSensor()
+
+            self.assertEqual(m.position,         42)
+            self.assertEqual(m.position,         42)
+            self.assertEqual(m.state,            ['running'])
+            self.assertEqual(m.snapshot(),       (42, 0, ['running'], 0))
+            self.assertEqual(s.value(0),         16)
+            self.assertEqual(s.bin_data('<b'),   (16,))
+        finally:
+            ev3.Device.RAW_FD = False
+
+    def test_warm(self):
+        clean_arena()
+        populate_arena({'medium_motor' : [0, 'outA']})
+
+        m = ev3.MediumMotor(preopen=True)
+        self.assertEqual(sorted(m._attributes), sorted(ev3.Motor.HOT_ATTRIBUTES))
+
+        m = ev3.MediumMotor(preopen=('position',))
+        self.assertEqual(list(m._attributes), ['position'])
+
+        # Properties use the files opened up front.
+        position = m._attributes['position']
+        m.warm(('position', 'state'))
+        self.assertTrue(m._attributes['position'] is position)
+        self.assertEqual(m.position, 42)
+        self.assertTrue(m._position is position)
+
+        m = ev3.MediumMotor(address='outD', preopen=True)
+        self.assertFalse(m.connected)
+        with self.assertRaises(Exception):
+            m.warm()
+
+    def test_attribute_modes(self):
+        clean_arena()
+        populate_arena({'medium_motor' : [0, 'outA']})
+        ev3.Device.invalidate_attribute_modes()
+
+        m = ev3.MediumMotor()
+        classpath = os.path.dirname(m._path)
+
+        # Writable modes are shared by all the devices of the class...
+        m.speed_sp
+        self.assertEqual(ev3.Device._attribute_modes[(classpath, 'speed_sp')], 'r+')
+
+        # ...read-only ones are not, as permissions may still change.
+        m.speed
+        self.assertFalse((classpath, 'speed') in ev3.Device._attribute_modes)
+
+        os.chmod(os.path.join(m._path, 'speed'), 0o664)
+        m = ev3.MediumMotor()
+        m.set_attr_int(None, 'speed', 5)
+        self.assertEqual(m.speed, 5)
+
+        ev3.Device.invalidate_attribute_modes('lego-sensor')
+        self.assertTrue((classpath, 'speed_sp') in ev3.Device._attribute_modes)
+        ev3.Device.invalidate_attribute_modes('tacho-motor')
+        self.assertFalse((classpath, 'speed_sp') in ev3.Device._attribute_modes)
+
     def test_infrared_sensor(self):
         clean_arena()
         populate_arena({'infrared_sensor' : [0, 'in1']})
@@ -89,9 +270,302 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(s.device_index,    0)
         self.assertEqual(s.bin_data_format, 's8')
         self.assertEqual(s.bin_data('<b'),  (16,))
+        self.assertEqual(s.bin_data_values(), (16,))
+        self.assertEqual(list(s.bin_data_array()), [16])
         self.assertEqual(s.num_values,      1)
         self.assertEqual(s.address,         'in1')
         self.assertEqual(s.value(0),        16)
+        self.assertEqual(s.mode_info.num_values, 1)
+        self.assertEqual(s.value_scaled(0), 16.0)
+
+    def test_sensor_mode_shared_per_port(self):
+        clean_arena()
+        populate_arena({'infrared_sensor' : [0, 'in1']})
+
+        s = ev3.InfraredSensor()
+        self.assertEqual(s.proximity, 16)
+        self.assertEqual(s.mode_info.mode, 'IR-PROX')
+
+        # The remote control switches its own sensor object on the same port.
+        rc = ev3.RemoteControl(channel=1)
+        self.assertEqual(s.mode_info.mode, 'IR-REMOTE')
+
+        # The proximity is read in the right mode again.
+        s.proximity
+        with open(os.path.join(s._path, 'mode')) as f:
+            # The fake files are not truncated when written.
+            self.assertTrue(f.read().startswith('IR-PROX'))
+
+        # Reading the mode brings all the objects up to date.
+        overwrite(s, 'mode', 'IR-SEEK')
+        self.assertEqual(rc._sensor.mode, 'IR-SEEK')
+        self.assertEqual(s.mode_info.mode, 'IR-SEEK')
+
+    def test_infrared_hub(self):
+        clean_arena()
+        populate_arena({'infrared_sensor' : [0, 'in1']})
+
+        s = ev3.InfraredSensor()
+
+        def set_values(*values):
+            with open(os.path.join(s._path, 'bin_data'), 'wb') as f:
+                f.write(bytes(bytearray(values)))
+
+        hub = ev3.InfraredHub(s, mode='IR-SEEK', max_age=1000)
+        seeker = hub.seeker(1)
+
+        self.assertEqual(seeker.heading, 16)
+        self.assertEqual(hub.values,     (16,))
+
+        # Within max_age the values of the last update are used...
+        set_values(5)
+        self.assertEqual(seeker.heading, 16)
+
+        # ...until the next update.
+        hub.update()
+        self.assertEqual(seeker.heading, 5)
+
+        # Older values are read again.
+        hub.max_age = 0
+        set_values(7)
+        self.assertEqual(seeker.heading, 7)
+
+        with self.assertRaises(Exception):
+            hub.remote(1)
+
+        hub = ev3.InfraredHub(s, mode='IR-REMOTE')
+        rc = hub.remote(1)
+
+        set_values(1)
+        hub.process()
+        self.assertEqual(rc.buttons_pressed, ['red_up'])
+        self.assertEqual(rc.red_up,          True)
+
+        with self.assertRaises(Exception):
+            hub.seeker(1)
+
+    def test_button_events(self):
+        import threading, time
+
+        class FakeButtons(ev3.ButtonBase):
+            on_a = None
+            on_b = None
+
+            def __init__(self):
+                self.pressed = []
+
+            @property
+            def buttons_pressed(self):
+                return self.pressed
+
+        btn = FakeButtons()
+        calls = []
+        btn.on_a = lambda state: calls.append(('a', state))
+        btn.on_b = lambda state: calls.append(('b', state))
+        btn.on_change = lambda changed: calls.append(changed)
+
+        # Handlers are called in button order, then on_change.
+        t = time.time()
+        btn.pressed = ['b', 'a']
+        btn.process()
+        self.assertEqual(calls, [('a', True), ('b', True), [('a', True), ('b', True)]])
+
+        # Nothing changed, nothing is called.
+        btn.process()
+        self.assertEqual(len(calls), 3)
+
+        self.assertEqual([(e.button, e.pressed) for e in btn.events_since(t - 1)],
+                         [('a', True), ('b', True)])
+        self.assertEqual(btn.events_since(time.time() + 1), [])
+
+        # Changes within the debounce time are ignored.
+        btn.debounce = 1000
+        btn.pressed = ['b']
+        btn.process()
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(btn.events_since(t - 1)), 2)
+        btn.debounce = 0
+        btn.process()
+        self.assertEqual(calls[-1], [('a', False)])
+
+        # Presses made while waiting are noticed.
+        btn.pressed = []
+        btn.process()
+        btn.poll_interval = 1
+        timer = threading.Timer(0.02, lambda: setattr(btn, 'pressed', ['a']))
+        timer.start()
+        self.assertTrue(btn.wait_for_press('a', timeout=1000))
+        self.assertFalse(btn.wait_for_press('b', timeout=20))
+        timer.join()
+
+    def test_button_async_iteration(self):
+        import asyncio
+
+        class FakeButtons(ev3.ButtonBase):
+            on_a = None
+            on_b = None
+
+            def __init__(self):
+                self.pressed = []
+
+            @property
+            def buttons_pressed(self):
+                return self.pressed
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            btn = FakeButtons()
+            first = btn.__aiter__()
+            second = btn.__aiter__()
+
+            # Two events recorded by one process() call.
+            btn.pressed = ['a', 'b']
+            btn.process()
+
+            events = loop.run_until_complete(asyncio.gather(first.__anext__(), first.__anext__()))
+            self.assertEqual([(e.button, e.pressed) for e in events], [('a', True), ('b', True)])
+
+            # Each iterator gets all the events.
+            events = loop.run_until_complete(asyncio.gather(second.__anext__(), second.__anext__()))
+            self.assertEqual([(e.button, e.pressed) for e in events], [('a', True), ('b', True)])
+
+            # Waiting calls stay pending until there is an event for them.
+            a = first.__anext__()
+            b = first.__anext__()
+            btn.pressed = ['b']
+            btn.process()
+            self.assertEqual((a.result().button, a.result().pressed), ('a', False))
+            self.assertFalse(b.done())
+
+            btn.pressed = ['a', 'b']
+            btn.process()
+            self.assertEqual((b.result().button, b.result().pressed), ('a', True))
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+
+    def test_loop(self):
+        import time
+        from ev3dev.control import Loop
+
+        ticks = []
+
+        def body(tick):
+            ticks.append(tick)
+            if tick == 0:
+                # Overrun by more than two periods.
+                time.sleep(0.035)
+            return len(ticks) < 3
+
+        loop = Loop(10)
+        loop.run(body)
+
+        # The ticks that passed during the overrun are skipped.
+        s = loop.stats()
+        self.assertEqual(ticks, [0, 3, 4])
+        self.assertEqual((s.ticks, s.overruns, s.skipped), (3, 1, 2))
+        self.assertEqual(s.exec_time.count, 2)
+        self.assertTrue(s.exec_time.max >= 0.035)
+
+        # stop() ends the loop before the next iteration.
+        ticks = []
+        for tick in loop:
+            ticks.append(tick)
+            loop.stop()
+        self.assertEqual(ticks, [0])
+
+    def test_duty_cycle_streamer(self):
+        from ev3dev.control import DutyCycleStreamer
+
+        clean_arena()
+        populate_arena({'medium_motor' : [0, 'outA']})
+
+        commands = []
+
+        class RecordingMotor(ev3.MediumMotor):
+            def run_direct(self, **kwargs):
+                commands.append(('run-direct', self.duty_cycle_sp))
+                super(RecordingMotor, self).run_direct(**kwargs)
+
+            def stop(self, **kwargs):
+                commands.append(('stop', self.duty_cycle_sp))
+                super(RecordingMotor, self).stop(**kwargs)
+
+        m = RecordingMotor()
+        streamer = DutyCycleStreamer((m,), ([150, -30, -30, -20],), rate=200)
+        self.assertEqual(len(streamer), 4)
+
+        # The first (clamped) frame is loaded before the motor starts, and
+        # the motor is stopped after the last one.
+        streamer.play()
+        self.assertEqual(commands, [('run-direct', 100), ('stop', -20)])
+
+    def test_sensor_sampler(self):
+        import time
+        from ev3dev.control import SensorSampler
+
+        clean_arena()
+        populate_arena({'medium_motor' : [0, 'outA']})
+
+        m = ev3.MediumMotor()
+        sampler = SensorSampler(rate=500, size=10)
+        position = sampler.add(m, 'position')
+        speed = sampler.add(m, 'speed')
+        # Not an integer, so every read of it fails.
+        state = sampler.add(m, 'state')
+
+        self.assertEqual(sampler.latest(position), None)
+        self.assertEqual(sampler.snapshot(), None)
+
+        sampler.start()
+        try:
+            deadline = time.monotonic() + 1
+            while sampler.count < 12 and time.monotonic() < deadline:
+                time.sleep(0.005)
+
+            with self.assertRaises(Exception):
+                sampler.add(m, 'duty_cycle')
+        finally:
+            sampler.stop()
+
+        self.assertTrue(sampler.count >= 12)
+        self.assertEqual(sampler.latest(position), 42)
+
+        t, values = sampler.snapshot()
+        self.assertEqual(values, (42, 0, 0))
+
+        times, values = sampler.window(speed, 9)
+        self.assertEqual(values, [0] * 9)
+        self.assertEqual(times[-1], t)
+        self.assertEqual(times, sorted(times))
+
+        with self.assertRaises(ValueError):
+            sampler.window(speed, 10)
+
+        # Failed reads repeat the previous value and are counted.
+        self.assertEqual(sampler.errors, sampler.count)
+        self.assertTrue(isinstance(sampler.last_error, ValueError))
+        self.assertEqual(sampler.latest(state), 0)
+
+    def test_filters(self):
+        from ev3dev.filters import MovingAverage, MedianFilter, KalmanFilter, ComplementaryFilter
+
+        f = MovingAverage(3)
+        self.assertEqual([f.update(x) for x in (3, 3, 3, 6)], [1, 2, 3, 4])
+
+        f = MedianFilter(3)
+        self.assertEqual([f.update(x) for x in (1, 100, 2, 3)], [0, 1, 2, 3])
+
+        f = KalmanFilter(0.01, 1)
+        for i in range(100):
+            f.update(5)
+        self.assertAlmostEqual(f.value, 5, places=2)
+
+        f = ComplementaryFilter()
+        for i in range(10):
+            f.update(1, 0.01)
+        self.assertAlmostEqual(f.value, 0.1)
 
 if __name__ == "__main__":
     unittest.main()
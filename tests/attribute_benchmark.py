@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Compares the cost of attribute access with the default (io.FileIO) and the
+raw file descriptor (os.pread/os.pwrite) attribute backends.
+
+The benchmark runs against the fake sysfs tree, so it only measures the
+Python side of the access path.
+"""
+import sys, os, timeit
+
+FAKE_SYS = os.path.join(os.path.dirname(__file__), 'fake-sys')
+
+sys.path.append(FAKE_SYS)
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from populate_arena import populate_arena
+from clean_arena    import clean_arena
+
+import ev3dev.core as ev3
+
+ev3.Device.DEVICE_ROOT_PATH = os.path.join(FAKE_SYS, 'arena')
+
+REPEAT = 5
+NUMBER = 10000
+
+def bench(raw_fd):
+    ev3.Device.RAW_FD = raw_fd
+
+    m = ev3.MediumMotor()
+    s = ev3.InfraredSensor()
+
+    # Open all the attribute files before timing anything.
+    m.position
+    m.duty_cycle_sp = 0
+    m.read_many(('position', 'speed', 'state', 'duty_cycle'))
+    s.value(0)
+
+    def write_duty_cycle():
+        m.duty_cycle_sp = 42
+
+    cases = (
+        ('Motor.position',       lambda: m.position),
+        ('Motor.duty_cycle_sp=', write_duty_cycle),
+        ('Motor.snapshot()',     m.snapshot),
+        ('Sensor.value(0)',      lambda: s.value(0)),
+    )
+
+    results = []
+    for name, f in cases:
+        t = min(timeit.repeat(f, repeat=REPEAT, number=NUMBER))
+        results.append((name, 1e6 * t / NUMBER))
+    return results
+
+if __name__ == "__main__":
+    clean_arena()
+    populate_arena({'medium_motor' : [0, 'outA'], 'infrared_sensor' : [0, 'in1']})
+
+    default = bench(raw_fd=False)
+    raw     = bench(raw_fd=True)
+
+    print('%-22s %12s %12s' % ('', 'FileIO, us', 'raw fd, us'))
+    for (name, t_default), (_, t_raw) in zip(default, raw):
+        print('%-22s %12.2f %12.2f' % (name, t_default, t_raw))
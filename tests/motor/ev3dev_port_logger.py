@@ -6,6 +6,7 @@ import time
 import threading
 
 import ev3dev.ev3 as ev3
+from ev3dev.control import Loop
 
 parser = argparse.ArgumentParser()
 parser.add_argument("infile", help="the name of the input specification")
@@ -23,20 +24,21 @@ class LogThread(threading.Thread):
 
     def run(self):
         tic = time.time()
-        toc = tic
         self.results = []
 
-        while not self.done.isSet():
+        # Readings that fall behind skip the ticks that passed meanwhile
+        self.loop = Loop(self.interval * 1e3)
+
+        for tick in self.loop:
+            if self.done.isSet():
+                break
+
             now = time.time()
             s = ()
             for a in self.attributes:
                 s += ( getattr( self.device, a ), )
             self.results.append((now-tic, s))
 
-            while .005 > toc - time.time():
-                toc += self.interval
-            time.sleep(toc - time.time())
-
     def join(self, timeout=None):
         self.done.set()
         super(LogThread, self).join(timeout)
@@ -86,4 +88,4 @@ for p,v in test['meta']['ports'].items():
      test['data'][p] = logs[p].results
 
 # Add a nice JSON formatter here - maybe?
-print json.dumps( test, indent = 4 )
+print( json.dumps( test, indent = 4 ) )